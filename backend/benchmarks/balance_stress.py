@@ -0,0 +1,70 @@
+"""
+Concurrent increment stress run for the balance store.
+
+Hammers one store file from several processes, each with several threads,
+then checks that no increment was lost.
+
+    python -m benchmarks.balance_stress --processes 4 --threads 8 --increments 500
+"""
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.balance_store import create_balance_store
+
+USERS = ["alice", "bob", "carol", "dave"]
+TOKEN = "USDC"
+
+
+def run_worker(backend: str, path: str, threads: int, increments: int):
+    store = create_balance_store(backend, path)
+
+    def hammer(thread_index: int):
+        for i in range(increments):
+            store.increment(USERS[(thread_index + i) % len(USERS)], TOKEN, 1.0)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(hammer, range(threads)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="sqlite")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--increments", type=int, default=500, help="increments per thread")
+    args = parser.parse_args()
+
+    if args.backend != "sqlite" and args.processes > 1:
+        parser.error("only the sqlite backend is safe across processes")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "balances.db" if args.backend == "sqlite" else "balances.json")
+        create_balance_store(args.backend, path)
+
+        started = time.perf_counter()
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(args.backend, path, args.threads, args.increments))
+            for _ in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        expected = args.processes * args.threads * args.increments
+        balances = create_balance_store(args.backend, path).all_balances()
+        total = sum(tokens.get(TOKEN, 0.0) for tokens in balances.values())
+
+    print(f"{expected} increments in {elapsed:.2f}s ({expected / elapsed:.0f} ops/s)")
+    print(f"expected total {expected}, stored total {total:.0f}, lost updates {expected - total:.0f}")
+    if total != expected:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
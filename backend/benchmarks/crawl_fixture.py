@@ -0,0 +1,219 @@
+"""
+Offline check of crawl.py against a local HTTP fixture server.
+
+Serves a handful of pages from 127.0.0.1 (one with no ETag, one that fails
+its first GETs) and runs four crawls in a scratch directory:
+
+1. first crawl: every page is fetched concurrently within CRAWL_CONCURRENCY,
+   the failing page succeeds after retries, and the index is built;
+2. nothing changed: pages with an ETag answer the HEAD with 304 and are not
+   fetched, the page without one is fetched but skipped by its content hash,
+   and information.version is left alone;
+3. one page changed: only that page is fetched and, with --reindex, only its
+   chunks are embedded;
+4. one page changed but fails every attempt: its last good copy is kept and
+   nothing is reindexed.
+
+Pages are fetched with httpx in place of the browser crawler, so the check
+needs neither crawl4ai nor network access. Exits non-zero on any failure.
+
+    python -m benchmarks.crawl_fixture
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from benchmarks.loadtest import BACKEND_DIR
+
+
+def page(name, version=1, paragraphs=6):
+    return "\n\n".join(f"{name} v{version} paragraph {i}: " + f"{name} pool yields and staking rewards " * 12
+                       for i in range(paragraphs))
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves server.pages, answering conditional HEADs with 304 and failing flaky pages first."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        body, etag = self.server.pages[self.path]
+        if etag and self.headers.get("If-None-Match") == etag:
+            self._send(304, etag=etag)
+        else:
+            self._send(200, etag=etag)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.gets[self.path] = server.gets.get(self.path, 0) + 1
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+            failing = server.failures.get(self.path, 0) > 0
+            if failing:
+                server.failures[self.path] -= 1
+        try:
+            time.sleep(server.delay)
+            if failing:
+                self._send(503)
+                return
+            body, etag = server.pages[self.path]
+            self._send(200, body.encode("utf-8"), etag)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+class HTTPCrawler:
+    """Stands in for crawl4ai's AsyncWebCrawler, returning the page body as its markdown."""
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(timeout=10)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    async def arun(self, url):
+        # Like crawl4ai, report a failed fetch in the result instead of raising
+        response = await self.client.get(url)
+        if response.is_error:
+            return SimpleNamespace(success=False, error_message=f"HTTP {response.status_code}", markdown="",
+                                   response_headers=dict(response.headers))
+        return SimpleNamespace(success=True, markdown=response.text, response_headers=dict(response.headers))
+
+
+def start_fixture_server(delay):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.delay = delay
+    server.pages = {
+        "/alpha": (page("alpha"), '"alpha-1"'),
+        "/beta": (page("beta"), '"beta-1"'),
+        "/gamma": (page("gamma"), '"gamma-1"'),
+        "/no-etag": (page("delta"), None),
+        "/flaky": (page("flaky"), '"flaky-1"'),
+    }
+    server.failures = {"/flaky": 2}
+    server.gets, server.in_flight, server.peak = {}, 0, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds each fixture GET takes")
+    args = parser.parse_args()
+
+    # crawl.py reads its settings at import; no domain spacing since every page is on 127.0.0.1
+    os.environ.update(CRAWL_CONCURRENCY=str(args.concurrency), CRAWL_DOMAIN_INTERVAL="0",
+                      CRAWL_MAX_RETRIES="3", CRAWL_BACKOFF_BASE="0.01")
+    sys.path.insert(0, BACKEND_DIR)
+    import crawl
+    from utils.vector_index import HashingEmbedder, chunk_text, load_index
+
+    class CountingEmbedder(HashingEmbedder):
+        def __init__(self):
+            super().__init__()
+            self.embedded = 0
+
+        def __call__(self, texts):
+            self.embedded += len(texts)
+            return super().__call__(texts)
+
+    server = start_fixture_server(args.delay)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    urls = [f"{base_url}{path}" for path in server.pages]
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'PASS' if ok else 'FAIL'}  {name}{f'  ({detail})' if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    def crawl_once(embedder):
+        server.gets.clear()
+        server.peak = 0
+        return asyncio.run(crawl.main(urls, reindex=True, crawler=HTTPCrawler(), embedder=embedder))
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            embedder = CountingEmbedder()
+            changed = crawl_once(embedder)
+            index = load_index()
+            check("first crawl fetches every source", changed == urls, f"{len(changed)}/{len(urls)} changed")
+            check("fetches run concurrently within the limit", 2 <= server.peak <= args.concurrency,
+                  f"peak {server.peak} in flight, limit {args.concurrency}")
+            check("failing source succeeds after retries", server.gets.get("/flaky") == 3,
+                  f"{server.gets.get('/flaky')} GETs")
+            check("index built from every chunk", index is not None and embedder.embedded == len(index.chunks),
+                  f"{embedder.embedded} embedded")
+            with open(crawl.MANIFEST_FILE, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            check("manifest records ETags", manifest[f"{base_url}/alpha"]["etag"] == '"alpha-1"')
+            leftovers = [name for _, _, files in os.walk(crawl.DATA_DIR) for name in files if name.endswith(".tmp")]
+            check("no temporary files left", not leftovers, ", ".join(leftovers))
+            version_mtime = os.stat(crawl.VERSION_FILE).st_mtime_ns
+
+            embedder = CountingEmbedder()
+            changed = crawl_once(embedder)
+            check("304 sources are not fetched", set(server.gets) == {"/no-etag"}, f"GETs {server.gets}")
+            check("refetched source with the same content is skipped", changed == [])
+            check("information.version untouched", os.stat(crawl.VERSION_FILE).st_mtime_ns == version_mtime)
+
+            server.pages["/beta"] = (page("beta", version=2), '"beta-2"')
+            embedder = CountingEmbedder()
+            changed = crawl_once(embedder)
+            beta_section = crawl.assemble_information(urls)[1]
+            check("only the changed source is fetched", set(server.gets) == {"/beta", "/no-etag"}, f"GETs {server.gets}")
+            check("changed source reported", changed == [f"{base_url}/beta"])
+            check("reindex embeds only the changed source", embedder.embedded == len(chunk_text(beta_section)),
+                  f"{embedder.embedded} of {len(load_index().chunks)} chunks embedded")
+            check("index serves the new content", "beta v2" in load_index().search("beta pool yields", 1)[0][1])
+
+            alpha_file = os.path.join(crawl.SOURCES_DIR, f"{crawl.source_id(f'{base_url}/alpha')}.md")
+            with open(alpha_file, "r", encoding="utf-8") as f:
+                alpha_before = f.read()
+            server.pages["/alpha"] = (page("alpha", version=2), '"alpha-2"')
+            server.failures["/alpha"] = 10
+            embedder = CountingEmbedder()
+            changed = crawl_once(embedder)
+            with open(alpha_file, "r", encoding="utf-8") as f:
+                alpha_after = f.read()
+            check("failing source is retried", server.gets.get("/alpha") == 4, f"{server.gets.get('/alpha')} GETs")
+            check("failing source keeps its last good copy", changed == [] and alpha_after == alpha_before)
+            check("nothing reindexed after a failed fetch", embedder.embedded == 0, f"{embedder.embedded} embedded")
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Replay logged planner outputs through the /process intent fast path.
+
+With JSON_LOGS=on every planner answer from /process is logged as a
+"planner_intent" event holding the input text, the planner's output and its
+latency. This script runs each logged input through IntentRouter and reports
+how many it answers locally, how often it agrees with the planner on those,
+and the latency of the fast path against the planner's logged latency.
+Disagreements are listed, since they mean a rule (or an intent name) is out
+of step with the planner prompt.
+
+    JSON_LOGS=on uvicorn server:app > server.log
+    python -m benchmarks.intent_replay --log server.log --rules intent_rules.json
+
+The rules are INTENT_RULES_PATH (or --rules), else the built-in ones, and
+are replayed whether or not INTENT_FAST_PATH is on, so a rules file can be
+checked before the fast path is enabled.
+
+Without --log it replays benchmarks/synthetic_planner_samples.jsonl. Those
+are hand-written examples in the log format, not real planner outputs, and
+were written alongside the built-in rules: they only exercise the script,
+and agreement on them says nothing about the planner.
+"""
+import os
+import json
+import time
+import argparse
+import statistics
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "synthetic_planner_samples.jsonl")
+
+
+def load_planner_log(path):
+    """Planner-answered planner_intent events; other log lines are skipped."""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("event") == "planner_intent" and record.get("source") == "planner":
+                records.append(record)
+    return records
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=SAMPLES_PATH, help="JSON log file with planner_intent events")
+    parser.add_argument("--rules", default=os.getenv("INTENT_RULES_PATH"), help="JSON rules file, defaults to the built-in rules")
+    parser.add_argument("--repeat", type=int, default=200, help="classifications per input when timing the fast path")
+    args = parser.parse_args()
+
+    from utils.intent_router import DEFAULT_RULES, IntentRouter, load_rules
+    router = IntentRouter(load_rules(args.rules) if args.rules else DEFAULT_RULES)
+
+    records = load_planner_log(args.log)
+    if not records:
+        raise SystemExit(f"no planner_intent events in {args.log}")
+
+    hits, agreed, disagreements = 0, 0, []
+    fast_us, planner_ms = [], []
+    for record in records:
+        text = record["input_text"]
+        expected = record["output"].get("intent_type")
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            output = router.classify(text)
+        fast_us.append((time.perf_counter() - started) / args.repeat * 1e6)
+        planner_ms.append(record.get("duration_ms", 0.0))
+        if output is None:
+            continue
+        hits += 1
+        if output["intent_type"] == expected:
+            agreed += 1
+        else:
+            disagreements.append((text, expected, output["intent_type"]))
+
+    total = len(records)
+    planner_mean = statistics.mean(planner_ms)
+    # Misses pay the (negligible) rule check and then the planner call as before
+    routed_mean = (sum(ms for ms, r in zip(planner_ms, records) if router.classify(r["input_text"]) is None)
+                   + sum(fast_us) / 1000) / total
+
+    if args.log == SAMPLES_PATH:
+        print("synthetic samples, not planner logs: agreement below only checks the rules against their own examples")
+    print(f"{total} logged planner calls from {args.log}")
+    print(f"fast path hits   {hits:>5}  ({hits / total:.0%} of inputs skip the planner)")
+    print(f"agreement        {agreed:>5}/{hits}  ({agreed / hits if hits else 0:.1%} of hits match the planner)")
+    print(f"fast path        p50 {percentile(fast_us, 0.5):7.1f}us  p99 {percentile(fast_us, 0.99):7.1f}us")
+    print(f"planner (logged) p50 {percentile(planner_ms, 0.5):7.1f}ms  p99 {percentile(planner_ms, 0.99):7.1f}ms")
+    print(f"mean /process intent latency {planner_mean:.1f}ms -> {routed_mean:.1f}ms")
+    for text, expected, got in disagreements:
+        print(f"  disagree: {text!r} planner={expected} fast_path={got}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+In-flight concurrency of the sync versus async upstream paths.
+
+Fires N concurrent planner calls and Serper news lookups at a stub that
+sleeps for --latency seconds per request. The sync path is driven from the
+event loop the way the old handlers did, so it completes one call at a time;
+the async path should finish in roughly one latency period.
+
+    python -m benchmarks.llm_concurrency --concurrency 200 --latency 0.5
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from benchmarks.stubs import start_stub_server
+
+
+async def run_sync(model, concurrency):
+    async def call():
+        return model.generate_text("INPUT_TEXT: deposit 100 USDC")
+    await asyncio.gather(*(call() for _ in range(concurrency)))
+
+
+async def run_async(model, concurrency):
+    await asyncio.gather(*(model.agenerate_text("INPUT_TEXT: deposit 100 USDC") for _ in range(concurrency)))
+
+
+async def run_news(concurrency):
+    from utils.google_trends import async_get_google_trend
+    await asyncio.gather(*(async_get_google_trend("news", f"query {i}") for i in range(concurrency)))
+
+
+async def measure(name, coroutine, concurrency):
+    started = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - started
+    print(f"{name:<12} {concurrency} calls in {elapsed:6.2f}s  ({concurrency / elapsed:7.1f} calls/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--sync-calls", type=int, default=10, help="the sync path is slow, so it gets fewer calls")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    os.environ["SERPER_BASE_URL"] = base_url
+    os.environ.setdefault("SERPER_API_KEY", "stub")
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ.setdefault("OPENAI_MODEL", "stub-model")
+    os.environ.setdefault("RESPONSE_CACHE", "off")
+    os.environ.setdefault("OPENAI_MAX_CONNECTIONS", str(args.concurrency))
+    os.environ.setdefault("LLM_MAX_IN_FLIGHT", str(args.concurrency))
+
+    from models.model import get_model
+    model = get_model("You are a planner.", 0)
+
+    async def scenario():
+        await measure("sync llm", run_sync(model, args.sync_calls), args.sync_calls)
+        await measure("async llm", run_async(model, args.concurrency), args.concurrency)
+        await measure("async news", run_news(args.concurrency), args.concurrency)
+
+    asyncio.run(scenario())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
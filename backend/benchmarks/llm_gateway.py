@@ -0,0 +1,95 @@
+"""
+Burst of LLM calls against a rate-limited provider, with and without the gateway.
+
+The stub answers 429 past --provider-rpm. Without admission control every
+call goes out at once and most of the burst fails; through LLMGateway,
+paced just under the provider limit and retrying 429s, the burst completes
+at close to the provider's rate. A third run with a small queue shows calls
+beyond it shed at once instead of waiting.
+
+    python -m benchmarks.llm_gateway --calls 200 --provider-rpm 600
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from benchmarks.stubs import start_stub_server
+
+
+async def burst(model, calls):
+    from models.model import LLMError, LLMUnavailableError
+
+    outcomes = {"ok": 0, "shed": 0, "failed": 0}
+    first_shed = []
+
+    async def call(i):
+        started = time.perf_counter()
+        try:
+            await model.agenerate_text(f"INPUT_TEXT: deposit {i} USDC")
+            outcomes["ok"] += 1
+        except LLMUnavailableError:
+            outcomes["shed"] += 1
+            first_shed.append(time.perf_counter() - started)
+        except LLMError:
+            outcomes["failed"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    await model.async_client.close()
+    shed_ms = 1000 * max(first_shed) if first_shed else 0.0
+    return outcomes, elapsed, shed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--provider-rpm", type=int, default=600)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--headroom", type=float, default=0.95, help="gateway rate as a fraction of the provider limit")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency, requests_per_minute=args.provider_rpm)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ.setdefault("OPENAI_MODEL", "stub-model")
+
+    from models.model import LLMGateway, OpenAIModel
+
+    runs = [
+        ("unbounded", LLMGateway(max_in_flight=args.calls, max_queue=args.calls, max_retries=0)),
+        ("gateway", LLMGateway(
+            max_in_flight=32,
+            max_queue=args.calls,
+            queue_timeout=3600,
+            requests_per_minute=args.provider_rpm * args.headroom,
+            max_retries=6,
+            backoff_base=0.25,
+        )),
+        ("small queue", LLMGateway(
+            max_in_flight=8,
+            max_queue=16,
+            queue_timeout=3600,
+            requests_per_minute=args.provider_rpm * args.headroom,
+            max_retries=6,
+            backoff_base=0.25,
+        )),
+    ]
+
+    print(f"{'mode':<14}{'ok':>6}{'failed':>8}{'shed':>6}{'elapsed':>10}{'ok/s':>8}{'shed in':>10}")
+    for name, gateway in runs:
+        # A fresh async client per run, since each run has its own event loop
+        model = OpenAIModel("You are a planner.", 0, gateway=gateway)
+        # Let the provider's bucket refill between runs
+        time.sleep(2)
+        outcomes, elapsed, shed_ms = asyncio.run(burst(model, args.calls))
+        print(f"{name:<14}{outcomes['ok']:>6}{outcomes['failed']:>8}{outcomes['shed']:>6}"
+              f"{elapsed:>9.1f}s{outcomes['ok'] / elapsed:>8.1f}{shed_ms:>8.2f}ms"
+              f"   retries={gateway.retries}")
+    print(f"provider limit: {args.provider_rpm / 60:.1f} calls/s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
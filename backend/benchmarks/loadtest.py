@@ -0,0 +1,252 @@
+"""
+Mixed-traffic load test of server.py against local upstream stubs.
+
+Starts the OpenAI/Serper stub and a uvicorn server pointed at it, drives
+weighted traffic across /process, /defiInfo, /search and /balance, and
+reports throughput and p50/p95/p99 latency per endpoint. Results are saved
+under benchmarks/results/ keyed by git commit so runs can be compared.
+
+Questions are generated with random tokens, protocols and amounts, and the
+response cache, news cache and news precompute are off unless --caches is
+given, so every call reaches the stub. Each scenario uses its own
+connection pool, so a connection the server drops after a 500 on one
+endpoint is not reused by another; such drops are counted as transport
+errors ("conn"), apart from 5xx responses ("err").
+
+    python -m benchmarks.loadtest --duration 30 --concurrency 64 --latency 0.3 --jitter 0.2
+    python -m benchmarks.loadtest --compare benchmarks/results/<earlier run>.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from contextlib import AsyncExitStack
+
+import httpx
+
+from benchmarks.stubs import start_stub_server
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+QUESTION_TEMPLATES = [
+    "What is the best {token} yield on {protocol}?",
+    "Which {protocol} pool has the highest TVL for {token}?",
+    "How does {token} staking work on {protocol}?",
+    "Is it safe to lend {amount} {token} on {protocol}?",
+    "deposit {amount} {token}",
+    "withdraw {amount} {token} from {protocol}",
+    "swap {amount} {token} to {other}",
+    "show my balance",
+]
+TOKENS = ["USDC", "HBAR", "HBARX", "ETH"]
+PROTOCOLS = ["Bonzo", "SaucerSwap", "Stader", "Aave", "KittyPunch"]
+SEARCH_TOPICS = ["hedera", "bitcoin", "stablecoin", "defi", "ethereum", "staking", "lending", "airdrop"]
+
+# (name, weight); weights roughly follow dashboard traffic
+SCENARIOS = [
+    ("process", 15),
+    ("defiInfo", 15),
+    ("search", 10),
+    ("balance_get", 30),
+    ("balance_set", 5),
+    ("balance_increment", 15),
+    ("balance_decrement", 10),
+]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, max(0, int(round(q / 100 * len(samples))) - 1))
+    return samples[index]
+
+
+def random_question():
+    token, other = random.sample(TOKENS, 2)
+    return random.choice(QUESTION_TEMPLATES).format(
+        token=token, other=other, protocol=random.choice(PROTOCOLS), amount=random.randint(1, 1000)
+    )
+
+
+def request_for(name, users):
+    user = random.choice(users)
+    token = random.choice(TOKENS)
+    if name == "process":
+        return "POST", "/process", {"input_text": random_question()}
+    if name == "defiInfo":
+        return "POST", "/defiInfo", {"input_text": random_question()}
+    if name == "search":
+        return "POST", "/search", {"query": f"{random.choice(SEARCH_TOPICS)} {random.choice(TOKENS).lower()} {random.randint(1, 1000)}"}
+    if name == "balance_get":
+        return "GET", f"/balance/{user}", None
+    if name == "balance_set":
+        return "POST", f"/balance/{user}/set", {"token_symbol": token, "balance": 1000.0}
+    if name == "balance_increment":
+        return "POST", f"/balance/{user}/increment", {"token_symbol": token, "amount": 1.0}
+    return "POST", f"/balance/{user}/decrement", {"token_symbol": token, "amount": 1.0}
+
+
+async def drive(base_url, duration, concurrency, users):
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    transport_errors = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with AsyncExitStack() as stack:
+        clients = {
+            name: await stack.enter_async_context(httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120))
+            for name in names
+        }
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = random.choices(names, weights)[0]
+                method, path, body = request_for(name, users)
+                started = time.perf_counter()
+                try:
+                    response = await clients[name].request(method, path, json=body)
+                    if response.status_code >= 500:
+                        errors[name] += 1
+                except httpx.HTTPError:
+                    transport_errors[name] += 1
+                latencies[name].append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name, samples in sorted(latencies.items()):
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": errors[name],
+            "transport_errors": transport_errors[name],
+            "throughput": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50),
+            "p95_ms": percentile(samples, 95),
+            "p99_ms": percentile(samples, 99),
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    every_sample = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "elapsed_s": elapsed,
+        "requests": total,
+        "throughput": total / elapsed,
+        "p50_ms": percentile(every_sample, 50),
+        "p95_ms": percentile(every_sample, 95),
+        "p99_ms": percentile(every_sample, 99),
+        "endpoints": endpoints,
+    }
+
+
+def wait_for_server(base_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become healthy in time")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result, baseline=None):
+    print(f"\n{'endpoint':<20}{'req':>8}{'err':>6}{'conn':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    totals = {key: sum(e.get(key, 0) for e in result["endpoints"].values()) for key in ("errors", "transport_errors")}
+    rows = list(result["endpoints"].items()) + [("TOTAL", {**result, **totals})]
+    for name, stats in rows:
+        line = (f"{name:<20}{stats['requests']:>8}{stats['errors']:>6}{stats.get('transport_errors', 0):>6}{stats['throughput']:>9.1f}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+        base = baseline and (baseline if name == "TOTAL" else baseline["endpoints"].get(name))
+        if base:
+            line += f"   p99 {stats['p99_ms'] - base['p99_ms']:+.1f} ms, rps {stats['throughput'] - base['throughput']:+.1f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of traffic")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="extra random stub latency, up to this many seconds")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--caches", action="store_true", help="leave the response and news caches on, so cache hits are measured too")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    stub = start_stub_server(latency=args.latency, jitter=args.jitter)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": f"{stub_url}/v1",
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_MODEL": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            "SERPER_BASE_URL": stub_url,
+            "SERPER_API_KEY": "stub",
+            "BALANCE_STORE_PATH": os.path.join(tmp_dir, "balances.db"),
+        }
+        if not args.caches:
+            env.update(RESPONSE_CACHE="off", NEWS_CACHE_TTL="0", NEWS_PRECOMPUTE="off")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            wait_for_server(base_url, server)
+            users = [f"user-{i}" for i in range(args.users)]
+            result = asyncio.run(drive(base_url, args.duration, args.concurrency, users))
+        finally:
+            server.terminate()
+            server.wait()
+            stub.shutdown()
+
+    result["config"] = {key: value for key, value in vars(args).items() if key not in ("compare", "no_save")}
+    result["commit"] = git_commit()
+    result["timestamp"] = time.time()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{result['commit']}-{int(result['timestamp'])}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Per-request overhead of building a fresh OpenAIModel versus the shared registry.
+
+Runs against the local stub server, so it measures client construction and
+connection setup rather than model latency.
+
+    python -m benchmarks.model_overhead --requests 200
+"""
+import os
+import time
+import argparse
+import statistics
+
+from benchmarks.stubs import start_stub_server
+
+
+def timed(fn, requests):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<10} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ.setdefault("OPENAI_MODEL", "stub-model")
+    os.environ.setdefault("RESPONSE_CACHE", "off")
+
+    from models.model import OpenAIModel, get_model
+
+    prompt = "INPUT_TEXT: deposit 100 USDC"
+
+    started = time.perf_counter()
+    get_model("You are a planner.", 0)
+    print(f"registry cold start {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    report("fresh", timed(lambda: OpenAIModel("You are a planner.", 0).generate_text(prompt), args.requests))
+    report("registry", timed(lambda: get_model("You are a planner.", 0).generate_text(prompt), args.requests))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
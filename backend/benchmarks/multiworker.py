@@ -0,0 +1,193 @@
+"""
+Consistency check of serve.py with several worker processes.
+
+Starts the upstream stub and `serve.py --workers N` on shared SQLite state,
+then hammers a small set of balances with concurrent increments, decrements
+and batches spread across the workers. Every acknowledged change is recorded
+and the final balances must match exactly, as must the balances at the end of
+each user's journal. It also checks that an LLM answer cached by one worker is
+served by the others without another upstream call. Exits non-zero on any
+inconsistency.
+
+With --backend redis the balances, journal and shared cache live on a local
+fakeredis server instead (needs `pip install redis "fakeredis[lua]"`), so the
+Redis code paths run without a Redis install.
+
+    python -m benchmarks.multiworker --workers 4 --requests 4000 --concurrency 64
+    python -m benchmarks.multiworker --backend redis
+"""
+import os
+import sys
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.loadtest import BACKEND_DIR, wait_for_server
+from benchmarks.stubs import start_stub_server
+
+TOKENS = ["USDC", "HBAR"]
+INITIAL_BALANCE = 1000.0
+CACHED_QUESTION = "How does HBARX staking work?"
+
+
+async def hammer_balances(client, users, total_requests, concurrency):
+    """Apply random changes and return the ledger of acknowledged ones."""
+    expected = {(user, token): INITIAL_BALANCE for user in users for token in TOKENS}
+    failures = defaultdict(int)
+    remaining = iter(range(total_requests))
+
+    async def worker():
+        for _ in remaining:
+            user, token = random.choice(users), random.choice(TOKENS)
+            amount = float(random.randint(1, 50))
+            choice = random.random()
+            if choice < 0.45:
+                response = await client.post(f"/balance/{user}/increment", json={"token_symbol": token, "amount": amount})
+                if response.status_code == 200:
+                    expected[(user, token)] += amount
+            elif choice < 0.9:
+                response = await client.post(f"/balance/{user}/decrement", json={"token_symbol": token, "amount": amount})
+                if response.status_code == 200:
+                    expected[(user, token)] -= amount
+            else:
+                other = random.choice(users)
+                response = await client.post("/balance/batch", json={"operations": [
+                    {"op": "decrement", "user_id": user, "token_symbol": token, "amount": amount},
+                    {"op": "increment", "user_id": other, "token_symbol": token, "amount": amount},
+                ]})
+                if response.status_code == 200:
+                    expected[(user, token)] -= amount
+                    expected[(other, token)] += amount
+            if response.status_code not in (200, 400):
+                failures[response.status_code] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return expected, failures
+
+
+async def run_checks(base_url, stub, args):
+    users = [f"mw-user-{i}" for i in range(args.users)]
+    # Drop idle connections before uvicorn's 5s keep-alive does, or a request can go out on a socket the
+    # server is closing and fail with ReadError while other requests queue on busy users
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency,
+                          keepalive_expiry=2)
+    problems = []
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        setup = [{"op": "set", "user_id": user, "token_symbol": token, "amount": INITIAL_BALANCE}
+                 for user in users for token in TOKENS]
+        (await client.post("/balance/batch", json={"operations": setup})).raise_for_status()
+
+        expected, failures = await hammer_balances(client, users, args.requests, args.concurrency)
+        if failures:
+            problems.append(f"unexpected statuses: {dict(failures)}")
+        mismatched = 0
+        for user in users:
+            balances = (await client.get(f"/balance/{user}")).json()["balances"]
+            for token in TOKENS:
+                if abs(balances.get(token, 0.0) - expected[(user, token)]) > 1e-6:
+                    mismatched += 1
+        print(f"balances: {args.requests} changes over {len(expected)} pairs, {mismatched} mismatched")
+        if mismatched:
+            problems.append(f"{mismatched} balances differ from the acknowledged changes")
+
+        # Each worker wrote part of every user's journal; paging through it must end at the final balances
+        journal_mismatched = 0
+        for user in users:
+            last, cursor = {}, 0
+            while cursor is not None:
+                page = (await client.get(f"/balance/{user}/history", params={"cursor": cursor, "limit": 1000})).json()
+                for entry in page["entries"]:
+                    last[entry["token_symbol"]] = entry["balance"]
+                cursor = page["next_cursor"]
+            journal_mismatched += sum(abs(last.get(token, 0.0) - expected[(user, token)]) > 1e-6 for token in TOKENS)
+        print(f"journal: {journal_mismatched} pairs whose last entry differs from the balance")
+        if journal_mismatched:
+            problems.append(f"{journal_mismatched} journal entries differ from the balances")
+
+        # One worker answers and caches; the rest should reuse its answer
+        (await client.post("/defiInfo", json={"input_text": CACHED_QUESTION})).raise_for_status()
+        before = stub.request_counts.get("/v1/chat/completions", 0)
+        await asyncio.gather(*(client.post("/defiInfo", json={"input_text": CACHED_QUESTION}) for _ in range(args.workers * 8)))
+        upstream_calls = stub.request_counts.get("/v1/chat/completions", 0) - before
+        print(f"response cache: {upstream_calls} upstream calls for {args.workers * 8} repeated questions")
+        if upstream_calls:
+            problems.append("cached answers were not shared between workers")
+    return problems
+
+
+def start_fake_redis():
+    """Serve an in-memory fakeredis over TCP on a free port, so worker processes can share it."""
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(("127.0.0.1", 0))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=4000, help="balance changes to send")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=8, help="few users, so workers contend on the same rows")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--backend", choices=["sqlite", "redis"], default="sqlite", help="where balances and shared state live")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    stub = start_stub_server(latency=0.05)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": f"{stub_url}/v1",
+            "OPENAI_API_KEY": "stub",
+            "SERPER_BASE_URL": stub_url,
+            "SERPER_API_KEY": "stub",
+            "BALANCE_STORE": "sqlite",
+            "BALANCE_STORE_PATH": os.path.join(tmp_dir, "balances.db"),
+            "SHARED_STATE": "sqlite",
+            "SHARED_STATE_PATH": os.path.join(tmp_dir, "shared_state.db"),
+            "RESPONSE_CACHE": "on",
+            "NEWS_PRECOMPUTE": "off",
+        }
+        redis_server = None
+        if args.backend == "redis":
+            redis_server = start_fake_redis()
+            env.pop("BALANCE_STORE_PATH")
+            env.update(BALANCE_STORE="redis", SHARED_STATE="redis",
+                       REDIS_URL=f"redis://127.0.0.1:{redis_server.server_address[1]}/0")
+        server = subprocess.Popen(
+            [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(args.port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            wait_for_server(base_url, server)
+            problems = asyncio.run(run_checks(base_url, stub, args))
+        finally:
+            server.terminate()
+            server.wait()
+            stub.shutdown()
+            if redis_server is not None:
+                redis_server.shutdown()
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK: workers agree on every balance and share cached answers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Multi-wallet, multi-chain balance fetch: one blocking request at a time versus PortfolioFetcher.
+
+Every request to the stub balance API sleeps for --latency seconds, so the
+sequential path takes about wallets * chains * latency. The fetcher fans out
+up to --concurrency requests at once, and a repeat of the same portfolio
+within the TTL is served from its cache.
+
+    python -m benchmarks.portfolio --wallets 20 --chains 1,56,137,8453 --latency 0.1
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from benchmarks.stubs import start_stub_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--chains", default="1,56,137,8453")
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    os.environ["INCH_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("INCH_API_KEY", "stub")
+
+    from utils.helper_functions import get_token_balances
+    from utils.portfolio import PortfolioFetcher
+
+    wallets = [f"0x{i:040x}" for i in range(args.wallets)]
+    chains = [int(chain) for chain in args.chains.split(",")]
+    pairs = len(wallets) * len(chains)
+
+    started = time.perf_counter()
+    sequential = {wallet: {chain: get_token_balances(wallet, chain) for chain in chains} for wallet in wallets}
+    sequential_s = time.perf_counter() - started
+
+    fetcher = PortfolioFetcher(ttl=60, concurrency=args.concurrency)
+
+    async def timed():
+        started = time.perf_counter()
+        portfolio = await fetcher.fetch_portfolio(wallets, chains)
+        return portfolio, time.perf_counter() - started
+
+    async def scenario():
+        cold, cold_s = await timed()
+        warm, warm_s = await timed()
+        return cold, cold_s, warm, warm_s
+
+    cold, cold_s, warm, warm_s = asyncio.run(scenario())
+    assert cold == sequential == warm, "fetchers disagree"
+
+    print(f"{pairs} (wallet, chain) pairs, {args.latency * 1000:.0f} ms upstream latency")
+    print(f"sequential      {sequential_s:7.2f}s")
+    print(f"fetcher cold    {cold_s:7.2f}s  ({sequential_s / cold_s:5.1f}x)")
+    print(f"fetcher cached  {warm_s * 1000:7.2f}ms")
+    print(f"stats: {fetcher.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
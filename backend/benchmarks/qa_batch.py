@@ -0,0 +1,109 @@
+"""
+Input tokens and wall time of N /defiInfo calls versus one /defiInfo/batch call.
+
+Starts the stub and server.py, asks the same questions both ways, and reads
+the per-endpoint token counters from /metrics. Without a retrieval index
+every /defiInfo call resends the whole crawl, so the batch should use about
+1/N of the input tokens per question.
+
+    python -m benchmarks.qa_batch --questions 8 --latency 0.3
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from benchmarks.loadtest import BACKEND_DIR, wait_for_server
+from benchmarks.stubs import start_stub_server
+
+QUESTIONS = [
+    "What is the best stablecoin yield on Hedera?",
+    "Which pool has the highest TVL on Bonzo?",
+    "How does HBARX staking work?",
+    "What are the risks of lending on Bonzo?",
+    "How do I bridge USDC to Hedera?",
+    "What is SaucerSwap?",
+    "How are staking rewards paid out?",
+    "Which tokens can be used as collateral?",
+]
+
+
+def token_counts(metrics_text, endpoint):
+    counts = {}
+    pattern = re.compile(r'llm_tokens_total\{direction="(\w+)",endpoint="([^"]+)",model="[^"]+"\} ([\d.]+)')
+    for direction, metric_endpoint, value in pattern.findall(metrics_text):
+        if metric_endpoint == endpoint:
+            counts[direction] = counts.get(direction, 0) + float(value)
+    return counts
+
+
+async def run(base_url, questions):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        started = time.perf_counter()
+        singles = await asyncio.gather(*(client.post("/defiInfo", json={"input_text": q}) for q in questions))
+        single_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch = await client.post("/defiInfo/batch", json={"questions": questions})
+        batch_s = time.perf_counter() - started
+
+        for response in singles + [batch]:
+            response.raise_for_status()
+        metrics_text = (await client.get("/metrics")).text
+    return single_s, batch_s, batch.json()["results"], metrics_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    questions = [QUESTIONS[i % len(QUESTIONS)] + ("" if i < len(QUESTIONS) else f" ({i})") for i in range(args.questions)]
+    stub = start_stub_server(latency=args.latency)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": f"{stub_url}/v1",
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_MODEL": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            "RESPONSE_CACHE": "off",
+            "NEWS_PRECOMPUTE": "off",
+            "BALANCE_STORE_PATH": os.path.join(tmp_dir, "balances.db"),
+            "QA_BATCH_SIZE": str(args.questions),
+        }
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            wait_for_server(base_url, server)
+            single_s, batch_s, results, metrics_text = asyncio.run(run(base_url, questions))
+        finally:
+            server.terminate()
+            server.wait()
+            stub.shutdown()
+
+    single = token_counts(metrics_text, "/defiInfo")
+    batch = token_counts(metrics_text, "/defiInfo/batch")
+    print(f"{len(questions)} questions")
+    print(f"{'mode':<10}{'input tok':>12}{'cached':>10}{'output':>8}{'wall':>8}")
+    print(f"{'single':<10}{single.get('input', 0):>12.0f}{single.get('cached_input', 0):>10.0f}{single.get('output', 0):>8.0f}{single_s:>7.2f}s")
+    print(f"{'batch':<10}{batch.get('input', 0):>12.0f}{batch.get('cached_input', 0):>10.0f}{batch.get('output', 0):>8.0f}{batch_s:>7.2f}s")
+    if batch.get("input"):
+        print(f"input tokens reduced {single.get('input', 0) / batch['input']:.1f}x; "
+              f"{sum(not r['batched'] for r in results)} answers needed a fallback call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Record traffic and its upstream calls to a cassette, then replay it against server.py offline.
+
+record: starts the OpenAI/Serper stub and server.py with CASSETTE_MODE=record,
+and sends open-loop mixed traffic at --rate requests/s. Production traffic
+is recorded the same way by running the server with CASSETTE_MODE=record.
+
+replay: starts server.py with CASSETTE_MODE=replay and every upstream URL
+pointed at a closed port, so nothing leaves the machine. It sends the
+recorded requests at their recorded offsets divided by --speedup. Upstream
+latencies are divided by the same factor, and latency per endpoint is
+reported. Run it with the same cassette and speedup before and after a
+change for a deterministic regression comparison.
+
+    python -m benchmarks.replay record --out /tmp/traffic.jsonl.gz --duration 30 --rate 20
+    python -m benchmarks.replay replay /tmp/traffic.jsonl.gz --speedup 10
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.loadtest import BACKEND_DIR, SCENARIOS, percentile, request_for, wait_for_server
+from benchmarks.stubs import start_stub_server
+from utils.cassette import Cassette, CASSETTE_FILE
+
+# Nothing listens here, so a replay that reaches the network fails loudly
+OFFLINE_URL = "http://127.0.0.1:9"
+
+
+def endpoint_of(path):
+    """Group /balance/<user>/... under one label, like the server's route templates."""
+    return re.sub(r"^/balance/(?!batch)[^/]+", "/balance/{user_id}", path)
+
+
+def start_server(port, env):
+    # Open-loop traffic leaves connections idle between requests; a short
+    # keep-alive lets the server close one just as the client reuses it.
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning",
+         "--timeout-keep-alive", "120"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_for_server(base_url, server)
+    # Start the clock only after warm-up, or a sped-up replay mostly measures it
+    deadline = time.time() + 60
+    while httpx.get(f"{base_url}/ready", timeout=5).status_code != 200:
+        if time.time() > deadline:
+            server.terminate()
+            raise RuntimeError(f"server not ready: {httpx.get(f'{base_url}/ready').json()}")
+        time.sleep(0.1)
+    return server
+
+
+def server_env(tmp_dir, **overrides):
+    return {
+        **os.environ,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_MODEL": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        "SERPER_API_KEY": "stub",
+        "NEWS_PRECOMPUTE": "off",
+        "BALANCE_STORE_PATH": os.path.join(tmp_dir, "balances.db"),
+        **overrides,
+    }
+
+
+async def send_all(base_url, requests):
+    """Send (offset, method, path, body) requests open-loop, each at its offset from the start."""
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        started = time.perf_counter()
+
+        async def send(offset, method, path, body):
+            await asyncio.sleep(max(0.0, offset - (time.perf_counter() - started)))
+            sent = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                ok = response.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            endpoint = endpoint_of(path.split("?")[0])
+            latencies[endpoint].append((time.perf_counter() - sent) * 1000)
+            if not ok:
+                errors[endpoint] += 1
+
+        await asyncio.gather(*(send(*request) for request in requests))
+        elapsed = time.perf_counter() - started
+        metrics_text = (await client.get("/metrics")).text
+    return latencies, errors, elapsed, metrics_text
+
+
+def record(args):
+    random.seed(args.seed)
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+    users = [f"user-{i}" for i in range(args.users)]
+    requests, offset = [], 0.0
+    while True:
+        offset += random.expovariate(args.rate)
+        if offset >= args.duration:
+            break
+        requests.append((offset, *request_for(random.choices(names, weights)[0], users)))
+
+    if os.path.exists(args.out):
+        os.remove(args.out)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    stub = start_stub_server(latency=args.latency, jitter=args.jitter)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = server_env(
+            tmp_dir,
+            OPENAI_BASE_URL=f"{stub_url}/v1",
+            SERPER_BASE_URL=stub_url,
+            CASSETTE_MODE="record",
+            CASSETTE_PATH=os.path.abspath(args.out),
+        )
+        server = start_server(args.port, env)
+        try:
+            latencies, errors, elapsed, metrics_text = asyncio.run(send_all(f"http://127.0.0.1:{args.port}", requests))
+        finally:
+            # Graceful shutdown closes the cassette file
+            server.terminate()
+            server.wait()
+            stub.shutdown()
+
+    print(f"recorded {len(requests)} requests over {elapsed:.1f}s to {args.out} ({os.path.getsize(args.out) / 1024:.0f} KiB)")
+    print_cassette_counts(metrics_text)
+
+
+def replay(args):
+    recorded = Cassette(args.cassette, "replay").requests
+    if not recorded:
+        raise SystemExit(f"no requests in {args.cassette}")
+    requests = [
+        (entry["t"] / args.speedup, entry["m"], entry["p"] + (f"?{entry['q']}" if entry["q"] else ""), entry["b"])
+        for entry in recorded
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = server_env(
+            tmp_dir,
+            OPENAI_BASE_URL=f"{OFFLINE_URL}/v1",
+            SERPER_BASE_URL=OFFLINE_URL,
+            INCH_BASE_URL=OFFLINE_URL,
+            CASSETTE_MODE="replay",
+            CASSETTE_PATH=os.path.abspath(args.cassette),
+            CASSETTE_SPEEDUP=str(args.speedup),
+        )
+        server = start_server(args.port, env)
+        try:
+            latencies, errors, elapsed, metrics_text = asyncio.run(send_all(f"http://127.0.0.1:{args.port}", requests))
+        finally:
+            server.terminate()
+            server.wait()
+
+    recorded_span = recorded[-1]["t"]
+    print(f"replayed {len(requests)} requests recorded over {recorded_span:.1f}s in {elapsed:.1f}s (speedup {args.speedup:g}x)")
+    print(f"{'endpoint':<28}{'requests':>9}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for endpoint, samples in sorted(latencies.items()):
+        print(f"{endpoint:<28}{len(samples):>9}{errors[endpoint]:>8}"
+              f"{percentile(samples, 50):>8.1f}ms{percentile(samples, 95):>8.1f}ms{percentile(samples, 99):>8.1f}ms")
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"throughput {total / elapsed:.1f} req/s")
+    print_cassette_counts(metrics_text)
+
+
+def print_cassette_counts(metrics_text):
+    pattern = re.compile(r'cassette_events_total\{kind="(\w+)",result="(\w+)"\} ([\d.]+)')
+    counts = ", ".join(f"{kind} {result} {float(value):.0f}" for kind, result, value in pattern.findall(metrics_text))
+    print(f"cassette: {counts or 'no upstream calls'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="record stub-backed traffic to a cassette")
+    record_parser.add_argument("--out", default=CASSETTE_FILE)
+    record_parser.add_argument("--duration", type=float, default=20, help="seconds of traffic")
+    record_parser.add_argument("--rate", type=float, default=20, help="mean requests per second")
+    record_parser.add_argument("--latency", type=float, default=0.3, help="stub upstream latency in seconds")
+    record_parser.add_argument("--jitter", type=float, default=0.2)
+    record_parser.add_argument("--users", type=int, default=50)
+    record_parser.add_argument("--seed", type=int, default=7)
+    record_parser.add_argument("--port", type=int, default=8769)
+
+    replay_parser = subparsers.add_parser("replay", help="replay a cassette against server.py offline")
+    replay_parser.add_argument("cassette")
+    replay_parser.add_argument("--speedup", type=float, default=1.0, help="divides request offsets and upstream latencies")
+    replay_parser.add_argument("--port", type=int, default=8769)
+
+    args = parser.parse_args()
+    record(args) if args.command == "record" else replay(args)
+
+
+if __name__ == "__main__":
+    main()
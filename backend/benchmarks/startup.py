@@ -0,0 +1,115 @@
+"""
+Cold-start profile of server.py: import time by module, then time to /health and /ready.
+
+Imports the server in a fresh interpreter under `python -X importtime` and
+lists the slowest modules by cumulative time. It also checks that the
+dependencies loaded on demand (openai, tiktoken, requests) stay out of the
+import, then starts uvicorn against the stub and times liveness and readiness.
+Exits non-zero if the import exceeds --max-import-ms or a lazy dependency
+is imported eagerly, so cold-start regressions fail CI.
+
+    python -m benchmarks.startup --top 15 --max-import-ms 1000
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from benchmarks.loadtest import BACKEND_DIR
+from benchmarks.stubs import start_stub_server
+
+LAZY_MODULES = ["openai", "tiktoken", "requests"]
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile_import(env):
+    """Per-module (self us, cumulative us, depth, name) from -X importtime, plus the eagerly loaded lazy modules."""
+    check = f"import sys, server; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = [
+        (int(self_us), int(cumulative_us), len(indent) // 2, name)
+        for self_us, cumulative_us, indent, name in IMPORTTIME_LINE.findall(result.stderr)
+    ]
+    eager = [name for name in result.stdout.strip().splitlines()[-1].split(",") if name] if result.stdout.strip() else []
+    return modules, eager
+
+
+def time_until(url, process, status=200, timeout=60):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            if httpx.get(url, timeout=1).status_code == status:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"{url} did not return {status} in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--max-import-ms", type=float, default=0, help="fail if importing server.py takes longer, 0 disables")
+    parser.add_argument("--port", type=int, default=8768)
+    args = parser.parse_args()
+
+    stub = start_stub_server()
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": f"{stub_url}/v1",
+            "OPENAI_API_KEY": "stub",
+            "NEWS_PRECOMPUTE": "off",
+            "BALANCE_STORE_PATH": os.path.join(tmp_dir, "balances.db"),
+        }
+        modules, eager = profile_import(env)
+
+        base_url = f"http://127.0.0.1:{args.port}"
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            healthy_at = time_until(f"{base_url}/health", server)
+            ready_at = time_until(f"{base_url}/ready", server)
+            checks = httpx.get(f"{base_url}/ready").json()["checks"]
+        finally:
+            server.terminate()
+            server.wait()
+            stub.shutdown()
+
+    server_import = next(m for m in modules if m[3] == "server")
+    total_ms = server_import[1] / 1000
+    top_level = [m for m in modules if m[2] == 1]
+
+    print(f"import server: {total_ms:.0f} ms")
+    print(f"\n{'module':<40}{'cumulative':>12}{'self':>10}")
+    for self_us, cumulative_us, _, name in sorted(top_level, key=lambda m: -m[1])[:args.top]:
+        print(f"{name:<40}{cumulative_us / 1000:>10.1f}ms{self_us / 1000:>8.1f}ms")
+    print(f"\nprocess start -> /health 200: {healthy_at - started:.2f}s")
+    print(f"process start -> /ready 200:  {ready_at - started:.2f}s  {checks}")
+
+    failures = []
+    if eager:
+        failures.append(f"loaded eagerly by server.py: {', '.join(eager)}")
+    if args.max_import_ms and total_ms > args.max_import_ms:
+        failures.append(f"import took {total_ms:.0f} ms, budget {args.max_import_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Local stand-ins for the upstream APIs used by the backend.
+
+    python -m benchmarks.stubs --port 9100 --latency 0.2
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:9100/v1,
+SERPER_BASE_URL=http://127.0.0.1:9100 and INCH_BASE_URL=http://127.0.0.1:9100.
+"""
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_JSON_CONTENT = json.dumps({"intent_type": "question"})
+STUB_TEXT_CONTENT = "Stub answer generated locally for benchmarking."
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves OpenAI-compatible chat completions and Serper searches with configurable latency."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus delayed ACK adds ~40 ms per response
+    disable_nagle_algorithm = True
+    latency = 0.0
+    jitter = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _sleep(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_rate_limited(self):
+        body = json.dumps({"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}}).encode("utf-8")
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, events):
+        """Send server-sent events with chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events:
+            data = f"data: {event}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        self.server.count(self.path)
+        parts = self.path.strip("/").split("/")
+        # /balance/v1.2/{chain_id}/balances/{wallet}
+        if len(parts) == 5 and parts[0] == "balance" and parts[3] == "balances":
+            self._sleep()
+            self._send_json(wallet_balances(int(parts[2]), parts[4]))
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def do_POST(self):
+        request = self._read_json()
+        self.server.count(self.path)
+        if self.path.endswith("/chat/completions") and not self.server.allow_completion():
+            self._send_rate_limited()
+        elif self.path.endswith("/chat/completions") and request.get("stream"):
+            self._sleep()
+            self._send_stream(chat_completion_chunks(request, self.server.prefix_cache.lookup(request)))
+        elif self.path.endswith("/chat/completions"):
+            self._sleep()
+            self._send_json(chat_completion(request, self.server.prefix_cache.lookup(request)))
+        elif self.path in ("/news", "/search"):
+            self._sleep()
+            self._send_json(serper_results(self.path.strip("/"), request))
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+
+def common_prefix_length(a, b):
+    """Binary search over slice comparisons, which run in C, instead of a per-character loop."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PrefixCache:
+    """
+    Imitates provider prompt caching: the longest prefix shared with a recent
+    prompt counts as cached, in 128-token steps, once it reaches 1024 tokens.
+    Prefixes match across message boundaries, as they do upstream.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def lookup(self, request):
+        text = "".join(f"{m.get('role')}:{m.get('content') or ''}\n" for m in request.get("messages", []))
+        with self._lock:
+            shared = max((common_prefix_length(text, seen) for seen in self._recent), default=0)
+            self._recent = [text] + [seen for seen in self._recent if seen != text][: self.size - 1]
+        tokens = shared // 4
+        return tokens // 128 * 128 if tokens >= 1024 else 0
+
+
+def batch_answers(prompt):
+    """JSON answers for a batch QA prompt's numbered QUESTIONS block."""
+    block = prompt.split("QUESTIONS:\n", 1)[1].split("\nOUTPUT:", 1)[0]
+    ids = [line.split(".", 1)[0] for line in block.splitlines() if line.split(".", 1)[0].isdigit()]
+    return json.dumps({"answers": [{"id": int(i), "answer": f"{STUB_TEXT_CONTENT} ({i})"} for i in ids]})
+
+
+def chat_completion(request, cached_tokens=0):
+    json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+    content = STUB_JSON_CONTENT if json_mode else STUB_TEXT_CONTENT
+    last_message = (request.get("messages") or [{}])[-1].get("content") or ""
+    if json_mode and "QUESTIONS:\n" in last_message:
+        content = batch_answers(last_message)
+    prompt_chars = sum(len(message.get("content") or "") for message in request.get("messages", []))
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model") or "stub",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (prompt_chars + len(content)) // 4,
+            "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_chars // 4)},
+        },
+    }
+
+
+def chat_completion_chunks(request, cached_tokens=0):
+    """Split the stub completion into OpenAI streaming chunks, ending with usage and [DONE]."""
+    completion = chat_completion(request, cached_tokens)
+    content = completion["choices"][0]["message"]["content"]
+    base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"]}
+    for word in content.split(" "):
+        delta = {"index": 0, "delta": {"content": word + " "}, "finish_reason": None}
+        yield json.dumps({**base, "choices": [delta]})
+    yield json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    if (request.get("stream_options") or {}).get("include_usage"):
+        yield json.dumps({**base, "choices": [], "usage": completion["usage"]})
+    yield "[DONE]"
+
+
+def wallet_balances(chain_id, wallet):
+    """Deterministic 1inch-style balances: token contract address -> raw balance string."""
+    seed = zlib.crc32(f"{chain_id}:{wallet.lower()}".encode("utf-8"))
+    tokens = {"0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee": str(seed * 10**9)}
+    for i in range(seed % 5):
+        tokens[f"0x{(seed + i):040x}"] = str((seed >> i) % 10**6 * 10**12)
+    return tokens
+
+
+def serper_results(search_type, request):
+    query = request.get("q", "")
+    items = [
+        {
+            "title": f"{query} headline {i}",
+            "link": f"https://news.example.com/{query}/{i}",
+            "snippet": f"Snippet {i} about {query}.",
+            "date": f"{i + 1} hours ago",
+            "source": "Stub News",
+        }
+        for i in range(int(request.get("num", 10)))
+    ]
+    if search_type == "news":
+        return {"news": items}
+    return {"organic": items, "relatedSearches": [{"query": f"{query} related"}]}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connection bursts from concurrent load tests
+    request_queue_size = 1024
+
+    # Chat completions allowed per minute before answering 429, like a provider limit; 0 is unlimited
+    requests_per_minute = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+        self._allowance = None
+        self.prefix_cache = PrefixCache()
+        self._allowance_at = time.monotonic()
+
+    def count(self, path):
+        with self._counts_lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def allow_completion(self):
+        """Token bucket refilled at requests_per_minute, bursting at most one second's worth."""
+        if not self.requests_per_minute:
+            return True
+        rate = self.requests_per_minute / 60.0
+        with self._counts_lock:
+            now = time.monotonic()
+            if self._allowance is None:
+                self._allowance = max(1.0, rate)
+            self._allowance = min(max(1.0, rate), self._allowance + (now - self._allowance_at) * rate)
+            self._allowance_at = now
+            if self._allowance < 1:
+                self.request_counts["rate_limited"] = self.request_counts.get("rate_limited", 0) + 1
+                return False
+            self._allowance -= 1
+            return True
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, requests_per_minute=0):
+    """
+    Start the stub server on a background thread.
+
+    requests_per_minute makes chat completions answer 429 past that rate.
+
+    Returns:
+        StubServer: Running server; its base URL is http://host:server.server_port.
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"latency": latency, "jitter": jitter})
+    server = StubServer((host, port), handler)
+    server.requests_per_minute = requests_per_minute
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay, up to this many seconds")
+    parser.add_argument("--rpm", type=int, default=0, help="chat completions per minute before 429s, 0 for unlimited")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.host, args.port, args.latency, args.jitter, args.rpm)
+    print(f"Stub upstreams listening on http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
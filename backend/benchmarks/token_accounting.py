@@ -0,0 +1,54 @@
+"""
+Per-request CPU cost of token accounting.
+
+Compares the old path (look up the encoding and tokenize system prompt plus
+corpus on every request) with the memoized encoder and cached static-segment
+counts. Needs the tiktoken encoding files to be available locally.
+
+    python -m benchmarks.token_accounting --corpus ./data/information.txt
+"""
+import time
+import argparse
+
+import tiktoken
+
+from prompts.qa import qa_prompt
+from utils.helper_functions import COMPLETIONS_MODEL, num_tokens_cached, num_tokens_from_string
+
+
+def old_count(system_prompt, prompt):
+    encoding = tiktoken.encoding_for_model(COMPLETIONS_MODEL)
+    return len(encoding.encode(system_prompt + prompt))
+
+
+def new_count(system_prompt, corpus, question):
+    return num_tokens_cached(system_prompt) + num_tokens_cached(corpus) + num_tokens_from_string(question)
+
+
+def cpu_ms(fn, requests):
+    started = time.process_time()
+    for _ in range(requests):
+        fn()
+    return (time.process_time() - started) * 1000 / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="./data/information.txt")
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = f.read()
+    question = "QUESTION: What is the best stablecoin yield on Hedera?\nOUTPUT:"
+
+    old = cpu_ms(lambda: old_count(qa_prompt, f"INFORMATION:{corpus}\n{question}"), args.requests)
+    new = cpu_ms(lambda: new_count(qa_prompt, corpus, question), args.requests)
+    print(f"corpus {len(corpus)} chars")
+    print(f"per-request tokenization  {old:8.3f} ms CPU")
+    print(f"memoized encoder + cache  {new:8.3f} ms CPU")
+    print("with TOKEN_ACCOUNTING=usage (default) no local tokenization runs at all")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,244 @@
-import asyncio
 import os
-from crawl4ai import *
-
-async def main():
-    urls = [
-        "https://stable.kittypunch.xyz/pools",
-        "https://app.bonzo.finance/dashboard", 
-        "https://www.staderlabs.com/hedera/defi/",
-        "https://defillama.com/chains",
-        "https://gho.aave.com/markets/",
-    ]
-    
-    data_dir = "./data"
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    
-    with open("./data/information.txt", "w", encoding="utf-8") as f:
-        async with AsyncWebCrawler() as crawler:
-            for i, url in enumerate(urls, 1):
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from urllib.parse import urlparse
+
+import httpx
+
+URLS = [
+    "https://stable.kittypunch.xyz/pools",
+    "https://app.bonzo.finance/dashboard",
+    "https://www.staderlabs.com/hedera/defi/",
+    "https://defillama.com/chains",
+    "https://gho.aave.com/markets/",
+]
+
+DATA_DIR = "./data"
+SOURCES_DIR = "./data/sources"
+MANIFEST_FILE = "./data/sources/manifest.json"
+INFORMATION_FILE = "./data/information.txt"
+VERSION_FILE = "./data/information.version"
+
+MAX_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 4))
+DOMAIN_INTERVAL = float(os.getenv("CRAWL_DOMAIN_INTERVAL", 1.0))
+MAX_RETRIES = int(os.getenv("CRAWL_MAX_RETRIES", 3))
+BACKOFF_BASE = float(os.getenv("CRAWL_BACKOFF_BASE", 1.0))
+
+
+class DomainRateLimiter:
+    """Keeps at least `interval` seconds between request starts to the same domain."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._locks = {}
+        self._last_started = {}
+
+    async def wait(self, url: str):
+        domain = urlparse(url).netloc
+        lock = self._locks.setdefault(domain, asyncio.Lock())
+        async with lock:
+            delay = self._last_started.get(domain, 0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_started[domain] = time.monotonic()
+
+
+def source_id(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_manifest() -> dict:
+    if os.path.exists(MANIFEST_FILE):
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def write_atomic(path: str, content: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+async def with_retries(fn, url: str):
+    """Run fn with jittered exponential backoff between attempts."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"Retry {attempt + 1} for {url} in {delay:.1f}s: {str(e)}")
+            await asyncio.sleep(delay)
+
+
+async def fetch_page(crawler, url: str):
+    """Crawl one page, raising when crawl4ai reports a failure (it returns success=False rather than raising)."""
+    result = await crawler.arun(url=url)
+    if not result.success:
+        raise RuntimeError(getattr(result, "error_message", None) or "crawl failed")
+    if not result.markdown:
+        raise RuntimeError("no content")
+    return result
+
+
+async def check_not_modified(client: httpx.AsyncClient, url: str, entry: dict):
+    """
+    Ask the origin whether the page changed since the last crawl.
+
+    Returns:
+        tuple: (not_modified, validators) where validators holds the ETag and Last-Modified headers.
+    """
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    response = await client.head(url, headers=headers, follow_redirects=True)
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return response.status_code == 304, validators
+
+
+async def crawl_source(index, url, crawler, client, semaphore, limiter, manifest):
+    """Crawl one source and store it on its own. Returns True if its content changed."""
+    sid = source_id(url)
+    entry = manifest.get(url, {})
+    source_file = os.path.join(SOURCES_DIR, f"{sid}.md")
+
+    async with semaphore:
+        await limiter.wait(url)
+        try:
+            if entry and os.path.exists(source_file):
                 try:
-                    print(f"Crawling {i} Website: {url}")
-                    result = await crawler.arun(url=url)
-                    
-
-                    f.write(f"\n{'='*80}\n")
-                    f.write(f"Website {i}: {url}\n")
-                    f.write(f"{'='*80}\n\n")
-                    
-                    if result.markdown:
-                        f.write(result.markdown)
-                    else:
-                        f.write("Cannot get content")
-                    
-                    f.write("\n\n")
-                    print(f"Successfully crawl: {url}")
-                    
-                except Exception as e:
-                    print(f"Crawl {url} Error: {str(e)}")
-                    f.write(f"\n{'='*80}\n")
-                    f.write(f"Website {i}: {url}\n")
-                    f.write(f"Error: {str(e)}\n")
-                    f.write(f"{'='*80}\n\n")
-    
-    print("Save all the information to ./data/information.txt")
+                    not_modified, validators = await check_not_modified(client, url, entry)
+                except httpx.HTTPError:
+                    not_modified, validators = False, {}
+                if not_modified:
+                    print(f"Not modified, skipping {index} Website: {url}")
+                    return False
+            else:
+                validators = {}
+
+            print(f"Crawling {index} Website: {url}")
+            result = await with_retries(lambda: fetch_page(crawler, url), url)
+            markdown = result.markdown
+            if not validators:
+                # First crawl of the source: keep the validators of the page itself
+                headers = {key.lower(): value for key, value in (getattr(result, "response_headers", None) or {}).items()}
+                validators = {"etag": headers.get("etag"), "last_modified": headers.get("last-modified")}
+        except Exception as e:
+            print(f"Crawl {url} Error: {str(e)}")
+            if os.path.exists(source_file):
+                # Keep serving the last good copy rather than replacing it with the error
+                return False
+            markdown = f"Error: {str(e)}"
+            validators = {}
+
+    digest = content_hash(markdown)
+    changed = digest != entry.get("hash")
+    if changed:
+        write_atomic(source_file, markdown)
+        print(f"Successfully crawl: {url}")
+    else:
+        print(f"Unchanged content: {url}")
+    manifest[url] = {
+        "id": sid,
+        "hash": digest,
+        "etag": validators.get("etag") or entry.get("etag"),
+        "last_modified": validators.get("last_modified") or entry.get("last_modified"),
+        "crawled_at": time.time(),
+    }
+    return changed
+
+
+def assemble_information(urls):
+    """Rebuild information.txt from the per-source files, in source order. Returns one section per source."""
+    parts = []
+    for i, url in enumerate(urls, 1):
+        source_file = os.path.join(SOURCES_DIR, f"{source_id(url)}.md")
+        with open(source_file, "r", encoding="utf-8") as f:
+            markdown = f.read()
+        parts.append(f"\n{'='*80}\nWebsite {i}: {url}\n{'='*80}\n\n{markdown}\n\n")
+    write_atomic(INFORMATION_FILE, "".join(parts))
+    return parts
+
+
+def reindex_sources(sections, embedder=None):
+    """
+    Rebuild the retrieval index from the source sections.
+
+    Each section is chunked on its own, so an unchanged source yields the same
+    chunks as last time and keeps its vectors; only changed sources are embedded.
+    """
+    from utils.vector_index import VectorIndex, chunk_text, get_embedder, load_index
+
+    chunks = [chunk for section in sections for chunk in chunk_text(section)]
+    VectorIndex.from_chunks(chunks, embedder or get_embedder(), previous=load_index()).save()
+    print(f"Rebuilt the retrieval index ({len(chunks)} chunks)")
+
+
+async def main(urls=URLS, reindex=False, crawler=None, embedder=None):
+    """
+    Crawl urls and rebuild information.txt if any of them changed.
+
+    Args:
+        urls (list): Sources to crawl, in the order they appear in information.txt.
+        reindex (bool): Also rebuild the retrieval index when a source changed.
+        crawler: Object with an async arun(url=...) returning a result with .markdown.
+            Defaults to crawl4ai's AsyncWebCrawler.
+        embedder: Embedder for the index, defaulting to the EMBEDDER env var.
+
+    Returns:
+        list: The urls whose content changed.
+    """
+    os.makedirs(SOURCES_DIR, exist_ok=True)
+    manifest = load_manifest()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = DomainRateLimiter(DOMAIN_INTERVAL)
+    if crawler is None:
+        from crawl4ai import AsyncWebCrawler
+        crawler = AsyncWebCrawler()
+
+    async with crawler, httpx.AsyncClient(timeout=15) as client:
+        changes = await asyncio.gather(*(
+            crawl_source(i, url, crawler, client, semaphore, limiter, manifest)
+            for i, url in enumerate(urls, 1)
+        ))
+
+    write_atomic(MANIFEST_FILE, json.dumps(manifest, indent=2))
+
+    changed_urls = [url for url, changed in zip(urls, changes) if changed]
+    if not changed_urls and os.path.exists(INFORMATION_FILE):
+        print("No source changed, ./data/information.txt left as is")
+        return changed_urls
+
+    sections = assemble_information(urls)
+    # Version marker read by the server to pick up a new crawl without a restart
+    write_atomic(VERSION_FILE, json.dumps(
+        {"hash": content_hash("".join(sections)), "changed": changed_urls, "crawled_at": time.time()}
+    ))
+    print(f"Save all the information to ./data/information.txt ({len(changed_urls)} sources changed)")
+
+    if reindex:
+        reindex_sources(sections, embedder)
+    return changed_urls
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Crawl the DeFi sources into ./data/information.txt")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the retrieval index when a source changed")
+    args = parser.parse_args()
+    asyncio.run(main(reindex=args.reindex))
@@ -1,108 +1,856 @@
 import os
-from utils.helper_functions import num_tokens_from_string
-from openai import OpenAI
+import time
+import random
+import asyncio
+import functools
+import collections
+import threading
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from types import SimpleNamespace
+from typing import NamedTuple
+import httpx
+from utils.helper_functions import num_tokens_from_string, num_tokens_cached
+from utils.prompt_builder import estimate_tokens
+from utils.response_cache import get_response_cache
+from utils.metrics import span, record_tokens
+from utils.cassette import get_cassette
 from dotenv import load_dotenv
 load_dotenv()
 
+# "usage" reads token counts from the API response, "local" counts them with tiktoken
+TOKEN_ACCOUNTING = os.getenv("TOKEN_ACCOUNTING", "usage").lower()
+
+_client = None
+_async_client = None
+_gateway = None
+_models = {}
+_registry_lock = threading.RLock()
+
+
+class LLMError(Exception):
+    """Raised when an LLM call fails for good, after the gateway's retries."""
+
+
+class LLMUnavailableError(LLMError):
+    """Raised when the gateway sheds a call instead of queueing it (queue full or queue deadline passed)."""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        self.retry_after = retry_after
+        super().__init__(f"LLM capacity exhausted: {reason}")
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute, holding at most one second's worth,
+    so a burst is spread out the way providers enforce their limits. The level
+    may go negative to carry debt from calls that used more than estimated.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until amount is available, 0 if it is available now."""
+        with self._lock:
+            self._refill(time.monotonic())
+            # A single call larger than the bucket waits for a full bucket rather than forever
+            amount = min(amount, self.capacity)
+            return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def _retry_after(error: Exception) -> float:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LLMGateway:
+    """
+    Admission control in front of the provider, shared by every OpenAIModel.
+
+    At most max_in_flight calls run at once; the rest wait in a queue of at
+    most max_queue callers for up to queue_timeout seconds, and anything
+    beyond that is rejected at once with LLMUnavailableError, which the
+    server turns into a 503. Calls also wait for budget in requests-per-minute
+    and tokens-per-minute buckets (0 disables a limit), sized to the provider
+    limits so bursts are smoothed instead of answered with 429s. 429, 5xx and
+    connection errors are retried with full-jitter exponential backoff,
+    honouring Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 32,
+        max_queue: int = 256,
+        queue_timeout: float = 30,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # One pool of slots for sync and async calls; async waiters are woken through their loop
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._async_waiters = collections.deque()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.retries = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    async def _take_slot(self, timeout: float) -> bool:
+        """Wait up to timeout for a slot without blocking the loop; False if none freed up."""
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        while not self._slots.acquire(blocking=False):
+            waiter = loop.create_future()
+            with self._lock:
+                self._async_waiters.append((loop, waiter))
+            # A slot released before the waiter was queued would not wake it
+            if self._slots.acquire(blocking=False):
+                waiter.cancel()
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                waiter.cancel()
+                return False
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                return False
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Woken but not going to use the slot, so pass the wake-up on
+                    self._wake_waiter()
+                raise
+        return True
+
+    def _release_slot(self):
+        self._slots.release()
+        self._wake_waiter()
+
+    def _wake_waiter(self):
+        with self._lock:
+            while self._async_waiters:
+                loop, waiter = self._async_waiters.popleft()
+                if not waiter.done():
+                    loop.call_soon_threadsafe(self._resolve_waiter, waiter)
+                    return
+
+    def _resolve_waiter(self, waiter):
+        if waiter.done():
+            self._wake_waiter()
+        else:
+            waiter.set_result(None)
+
+    def _admit(self, contended: bool):
+        with self._lock:
+            if contended and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise LLMUnavailableError("queue full")
+            self.queued += 1
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+        return LLMUnavailableError("queue deadline passed", retry_after=self.queue_timeout)
+
+    def _budget_delay(self, tokens: float) -> float:
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.delay_for(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.delay_for(tokens))
+        if delay == 0.0:
+            if self.request_bucket is not None:
+                self.request_bucket.take(1)
+            if self.token_bucket is not None:
+                self.token_bucket.take(tokens)
+        return delay
+
+    def retry_delay(self, error: Exception, attempt: int):
+        """Backoff before the next attempt, or None if the error should propagate."""
+        if attempt >= self.max_retries or not _is_retryable(error):
+            return None
+        with self._lock:
+            self.retries += 1
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return max(_retry_after(error), random.uniform(0, backoff))
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: float):
+        """Hold one in-flight slot with rate budget taken, e.g. for the length of a stream."""
+        deadline = time.monotonic() + self.queue_timeout
+        self._admit(self.in_flight >= self.max_in_flight)
+        try:
+            with span("llm_queue"):
+                # A free slot is taken without suspending, so the next caller already sees it taken
+                if not await self._take_slot(self.queue_timeout):
+                    raise self._timed_out()
+        finally:
+            with self._lock:
+                self.queued -= 1
+        with self._lock:
+            self.in_flight += 1
+        try:
+            with span("llm_queue"):
+                while (delay := self._budget_delay(estimated_tokens)) > 0:
+                    if time.monotonic() + delay > deadline:
+                        raise self._timed_out()
+                    await asyncio.sleep(delay)
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._release_slot()
+
+    async def call(self, fn, estimated_tokens: float):
+        """Run `await fn()` under admission control, retrying transient provider errors."""
+        async with self.acquire(estimated_tokens):
+            attempt = 0
+            while True:
+                try:
+                    return await fn()
+                except Exception as e:
+                    delay = self.retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    while (delay := self._budget_delay(estimated_tokens)) > 0:
+                        await asyncio.sleep(delay)
+
+    @contextmanager
+    def acquire_sync(self, estimated_tokens: float):
+        """Blocking counterpart of acquire, for the sync client in worker threads."""
+        deadline = time.monotonic() + self.queue_timeout
+        self._admit(self.in_flight >= self.max_in_flight)
+        try:
+            with span("llm_queue"):
+                if not self._slots.acquire(timeout=self.queue_timeout):
+                    raise self._timed_out()
+        finally:
+            with self._lock:
+                self.queued -= 1
+        with self._lock:
+            self.in_flight += 1
+        try:
+            with span("llm_queue"):
+                while (delay := self._budget_delay(estimated_tokens)) > 0:
+                    if time.monotonic() + delay > deadline:
+                        raise self._timed_out()
+                    time.sleep(delay)
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._release_slot()
+
+    def call_sync(self, fn, estimated_tokens: float):
+        """Blocking counterpart of call."""
+        with self.acquire_sync(estimated_tokens):
+            attempt = 0
+            while True:
+                try:
+                    return fn()
+                except Exception as e:
+                    delay = self.retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    time.sleep(delay)
+                    while (delay := self._budget_delay(estimated_tokens)) > 0:
+                        time.sleep(delay)
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """Correct the token bucket once a call's real usage is known."""
+        if self.token_bucket is not None:
+            self.token_bucket.take(actual_tokens - estimated_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 30)),
+    )
+
+def _pool_timeout():
+    return httpx.Timeout(
+        float(os.getenv("OPENAI_TIMEOUT", 60)),
+        connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5)),
+    )
+
+def get_openai_client():
+    """
+    Return the process-wide OpenAI client.
+
+    The client shares one keep-alive connection pool, so requests skip the
+    TCP/TLS handshake once the pool is warm. Pool size and timeouts come from
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_TIMEOUT and OPENAI_CONNECT_TIMEOUT.
+    """
+    global _client
+    if _client is None:
+        with _registry_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                _client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_BASE_URL"),
+                    # Retries are owned by the gateway, which paces them against the rate limits
+                    max_retries=0,
+                    http_client=httpx.Client(limits=_pool_limits(), timeout=_pool_timeout()),
+                )
+    return _client
+
+def get_async_openai_client():
+    """Return the process-wide AsyncOpenAI client, pooled with the same limits as the sync one."""
+    global _async_client
+    if _async_client is None:
+        with _registry_lock:
+            if _async_client is None:
+                from openai import AsyncOpenAI
+
+                _async_client = AsyncOpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_BASE_URL"),
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=_pool_limits(), timeout=_pool_timeout()),
+                )
+    return _async_client
+
+def get_llm_gateway():
+    """
+    Return the process-wide LLMGateway.
+
+    Configured with LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT,
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE and LLM_BACKOFF_MAX. Limits apply per worker process.
+    """
+    global _gateway
+    if _gateway is None:
+        with _registry_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(
+                    max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", 32)),
+                    max_queue=int(os.getenv("LLM_MAX_QUEUE", 256)),
+                    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", 30)),
+                    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", 0)),
+                    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", 0)),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", 4)),
+                    backoff_base=float(os.getenv("LLM_BACKOFF_BASE", 0.5)),
+                    backoff_max=float(os.getenv("LLM_BACKOFF_MAX", 20)),
+                )
+    return _gateway
+
+def get_model(system_prompt, temperature, model=None):
+    """
+    Return a shared OpenAIModel for (system_prompt, temperature, model).
+
+    Args:
+        system_prompt (str): System prompt of the model.
+        temperature (float): Sampling temperature.
+        model (str, optional): Model name. Defaults to the OPENAI_MODEL env var.
+
+    Returns:
+        OpenAIModel: Cached instance backed by the shared client.
+    """
+    model = model or os.getenv("OPENAI_MODEL")
+    key = (system_prompt, temperature, model)
+    instance = _models.get(key)
+    if instance is None:
+        with _registry_lock:
+            instance = _models.get(key)
+            if instance is None:
+                instance = OpenAIModel(
+                    system_prompt,
+                    temperature,
+                    model=model,
+                    client=get_openai_client(),
+                    async_client=get_async_openai_client(),
+                    cache=get_response_cache(),
+                    gateway=get_llm_gateway(),
+                )
+                _models[key] = instance
+    return instance
+
+class PromptSegments(NamedTuple):
+    """
+    User prompt split into a static part, identical across requests, and a per-request dynamic part.
+
+    The static part is sent as its own message right after the system prompt,
+    so every request shares the same leading tokens and the provider's prompt
+    cache can serve them. Put anything that varies per request in dynamic.
+    """
+    static: str
+    dynamic: str
+
+
+def _prompt_text(prompt):
+    """Flat text of a str or PromptSegments prompt, e.g. for cache keys."""
+    if isinstance(prompt, PromptSegments):
+        return f"{prompt.static}\n{prompt.dynamic}"
+    return prompt
+
+
+def _usage_to_cassette(usage):
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    return [usage.prompt_tokens, usage.completion_tokens, cached_tokens]
+
+
+def _usage_from_cassette(recorded):
+    if recorded is None:
+        return None
+    prompt_tokens, completion_tokens, cached_tokens = recorded
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+def _completion_to_cassette(completion):
+    return {"content": completion.choices[0].message.content, "usage": _usage_to_cassette(completion.usage)}
+
+
+def _completion_from_cassette(recorded):
+    """Just the fields OpenAIModel reads from a chat completion."""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=recorded["content"]))],
+        usage=_usage_from_cassette(recorded["usage"]),
+    )
+
+
+async def _recording_stream(stream, cassette, kwargs, started):
+    """Pass a completion stream through while recording its deltas, usage and time to first token."""
+    chunks, usage, first_ms = [], None, None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first_ms is None:
+                first_ms = (time.perf_counter() - started) * 1000
+            chunks.append(chunk.choices[0].delta.content)
+        if chunk.usage:
+            usage = chunk.usage
+        yield chunk
+    total_ms = (time.perf_counter() - started) * 1000
+    cassette.record("llm_stream", kwargs, {"chunks": chunks, "usage": _usage_to_cassette(usage), "first_ms": first_ms or total_ms}, total_ms)
+
+
+async def _replayed_stream(recording, speedup):
+    """Recorded deltas as stream chunks, paced like the original stream divided by speedup."""
+    response, delay = recording["response"], recording["delay"]
+    first_delay = response["first_ms"] / 1000 / speedup if speedup > 0 else 0.0
+    await asyncio.sleep(first_delay)
+    step = max(0.0, delay - first_delay) / max(1, len(response["chunks"]))
+    for index, content in enumerate(response["chunks"]):
+        if index:
+            await asyncio.sleep(step)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+    yield SimpleNamespace(choices=[], usage=_usage_from_cassette(response["usage"]))
+
+
+# Expected completion length, reserved from the tokens-per-minute budget until usage is known
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 500))
+
+class LLMStream:
+    """
+    An opened completion stream, holding its gateway slot until it ends or is closed.
+
+    Iterating it yields {"type": "token", "content": ...} for every delta, then
+    one {"type": "usage", "input_tokens": ..., "output_tokens": ...} event, or
+    a single {"type": "error", "error": ...} event if the stream breaks off.
+    aclose() releases the slot if the stream is never read to the end, e.g.
+    as the response's background task when the client goes away.
+    """
+
+    def __init__(self, model, slot: AsyncExitStack, stream, prompt, estimated_tokens: float):
+        self.model = model
+        self.slot = slot
+        self.stream = stream
+        self.prompt = prompt
+        self.estimated_tokens = estimated_tokens
+
+    async def __aiter__(self):
+        chunks = []
+        usage = None
+        try:
+            with span("llm_stream"):
+                async for chunk in self.stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield {"type": "token", "content": chunk.choices[0].delta.content}
+                    if chunk.usage:
+                        usage = chunk.usage
+        except Exception as e:
+            response = {"error": f"Error in invoking model! {str(e)}"}
+            print(response)
+            yield {"type": "error", **response}
+            return
+        finally:
+            await self.aclose()
+
+        input_tokens_length, output_tokens_length = self.model._token_counts(self.prompt, "".join(chunks), usage)
+        self.model.gateway.settle(self.estimated_tokens, input_tokens_length + output_tokens_length)
+        yield {"type": "usage", "input_tokens": input_tokens_length, "output_tokens": output_tokens_length}
+
+    async def aclose(self):
+        """Close the provider stream and release the gateway slot; safe to call more than once."""
+        try:
+            # openai's AsyncStream has close(), the cassette's generators aclose()
+            close = getattr(self.stream, "aclose", None) or getattr(self.stream, "close", None)
+            if close is not None:
+                await close()
+        finally:
+            await self.slot.aclose()
+
+
 class OpenAIModel:
-    def __init__(self, system_prompt, temperature):
+    def __init__(self, system_prompt, temperature, model=None, client=None, async_client=None, cache=None, gateway=None):
         self.temperature = temperature
         self.system_prompt = system_prompt
+        # Only deterministic (temperature 0) calls are worth caching
+        self.cache = cache if temperature == 0 else None
+        self.gateway = gateway or get_llm_gateway()
         
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
+        self._client = client
+        self._async_client = async_client
+        self.model = model or os.getenv("OPENAI_MODEL")
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL"),
+                max_retries=0,
+            )
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+
+            self._async_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL"),
+                max_retries=0,
+            )
+        return self._async_client
+
+    def _completion_kwargs(self, prompt, json_mode):
+        if isinstance(prompt, PromptSegments):
+            user_messages = [
+                {"role": "user", "content": prompt.static},
+                {"role": "user", "content": prompt.dynamic},
+            ]
+        else:
+            user_messages = [{"role": "user", "content": prompt}]
+        kwargs = {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.system_prompt
+                },
+                *user_messages,
+            ],
+            "temperature": self.temperature,
+            "max_tokens": 10000,
+            "model": self.model,
+        }
+        if json_mode:
+            kwargs["response_format"] = { "type": "json_object" }
+        return kwargs
+
+    def _create_completion(self, kwargs):
+        """Chat completion from the API, or through the cassette when CASSETTE_MODE is set."""
+        cassette = get_cassette()
+        if cassette is None:
+            return self.client.chat.completions.create(**kwargs)
+        return cassette.call(
+            "llm", kwargs, lambda: self.client.chat.completions.create(**kwargs),
+            encode=_completion_to_cassette, decode=_completion_from_cassette,
         )
-        self.model = os.getenv("OPENAI_MODEL")
-            
-    def generate_text(self, prompt):
+
+    async def _acreate_completion(self, kwargs):
+        """Async counterpart of _create_completion."""
+        cassette = get_cassette()
+        if cassette is None:
+            return await self.async_client.chat.completions.create(**kwargs)
+        return await cassette.acall(
+            "llm", kwargs, lambda: self.async_client.chat.completions.create(**kwargs),
+            encode=_completion_to_cassette, decode=_completion_from_cassette,
+        )
+
+    async def _aopen_stream(self, kwargs):
+        """Open a completion stream, recording or replaying it when CASSETTE_MODE is set."""
+        cassette = get_cassette()
+        if cassette is not None and cassette.mode == "replay":
+            return _replayed_stream(cassette.replay("llm_stream", kwargs), cassette.speedup)
+        started = time.perf_counter()
+        stream = await self.async_client.chat.completions.create(**kwargs)
+        if cassette is None:
+            return stream
+        return _recording_stream(stream, cassette, kwargs, started)
+
+    def _cache_model(self, json_mode):
+        return f"{self.model}|json" if json_mode else self.model
+
+    def _cache_get(self, prompt, json_mode, semantic_text):
+        if self.cache is None:
+            return None
+        return self.cache.get(self._cache_model(json_mode), self.system_prompt, _prompt_text(prompt), semantic_text)
+
+    def _cache_set(self, prompt, json_mode, result, semantic_text):
+        if self.cache is not None:
+            self.cache.set(self._cache_model(json_mode), self.system_prompt, _prompt_text(prompt), result, semantic_text)
+
+    async def _run_cache(self, fn, *args):
+        """Semantic and shared-store lookups do I/O, so keep them off the event loop."""
+        if self.cache is None or not self.cache.blocking:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+
+    def _token_counts(self, prompt, response, usage):
+        """
+        Input and output token counts of a call, also recorded in the token metrics.
+
+        Uses the API's returned usage unless TOKEN_ACCOUNTING is "local"; local
+        counting reuses the memoized counts of the system prompt and of a
+        static prompt segment. Input tokens served from the provider's prompt
+        cache are recorded separately when usage reports them.
+        """
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        if usage is not None and TOKEN_ACCOUNTING != "local":
+            input_tokens_length, output_tokens_length = usage.prompt_tokens, usage.completion_tokens
+        else:
+            with span("tokenization"):
+                input_tokens_length = num_tokens_cached(self.system_prompt)
+                if isinstance(prompt, PromptSegments):
+                    input_tokens_length += num_tokens_cached(prompt.static) + num_tokens_from_string(prompt.dynamic)
+                else:
+                    input_tokens_length += num_tokens_from_string(prompt)
+                output_tokens_length = num_tokens_from_string(response or "")
+        record_tokens(self.model, input_tokens_length, output_tokens_length, cached_tokens)
+        return input_tokens_length, output_tokens_length
+
+    def _estimated_tokens(self, prompt):
+        return estimate_tokens(self.system_prompt) + estimate_tokens(_prompt_text(prompt)) + EXPECTED_OUTPUT_TOKENS
+
+    def _generate(self, prompt, json_mode, semantic_text=None):
+        """
+        Returns:
+            Tuple[str, int, int]: Response text, input tokens and output tokens.
+
+        Raises:
+            LLMUnavailableError: If the gateway sheds the call.
+            LLMError: If the call still fails after retries.
+        """
+        cached = self._cache_get(prompt, json_mode, semantic_text)
+        if cached is not None:
+            return cached
+        kwargs = self._completion_kwargs(prompt, json_mode)
+        estimated_tokens = self._estimated_tokens(prompt)
+
+        def request():
+            with span("llm"):
+                return self._create_completion(kwargs)
+
         try:
-            input_tokens_length = num_tokens_from_string(self.system_prompt + prompt)
-            print("input tokens length", input_tokens_length)
-            
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=self.temperature,
-                max_tokens=10000,
-                model=self.model, 
-                response_format={ "type": "json_object" }
-            )
-            
-            response = chat_completion.choices[0].message.content
-            output_tokens_length = num_tokens_from_string(response)
-            print("output tokens length", output_tokens_length)
-            return response, input_tokens_length, output_tokens_length
-        
+            chat_completion = self.gateway.call_sync(request, estimated_tokens)
+        except LLMError:
+            raise
         except Exception as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            print(response)
-            return response
-        
-    def generate_string_text(self, prompt):
+            print(f"Error in invoking model! {str(e)}")
+            raise LLMError(f"Error in invoking model! {str(e)}") from e
+
+        response = chat_completion.choices[0].message.content
+        input_tokens_length, output_tokens_length = self._token_counts(prompt, response, chat_completion.usage)
+        self.gateway.settle(estimated_tokens, input_tokens_length + output_tokens_length)
+        result = response, input_tokens_length, output_tokens_length
+        self._cache_set(prompt, json_mode, result, semantic_text)
+        return result
+
+    async def _agenerate(self, prompt, json_mode, semantic_text=None):
+        """Async counterpart of _generate, with the same return value and errors."""
+        cached = await self._run_cache(self._cache_get, prompt, json_mode, semantic_text)
+        if cached is not None:
+            return cached
+        kwargs = self._completion_kwargs(prompt, json_mode)
+        estimated_tokens = self._estimated_tokens(prompt)
+
+        async def request():
+            with span("llm"):
+                return await self._acreate_completion(kwargs)
+
         try:
-            input_tokens_length = num_tokens_from_string(self.system_prompt + prompt)
-            print("input tokens length", input_tokens_length)
-            
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=self.temperature,
-                model=self.model, 
-                max_tokens=10000,
-            )
+            chat_completion = await self.gateway.call(request, estimated_tokens)
+        except LLMError:
+            raise
+        except Exception as e:
+            print(f"Error in invoking model! {str(e)}")
+            raise LLMError(f"Error in invoking model! {str(e)}") from e
+
+        response = chat_completion.choices[0].message.content
+        input_tokens_length, output_tokens_length = self._token_counts(prompt, response, chat_completion.usage)
+        self.gateway.settle(estimated_tokens, input_tokens_length + output_tokens_length)
+        result = response, input_tokens_length, output_tokens_length
+        await self._run_cache(self._cache_set, prompt, json_mode, result, semantic_text)
+        return result
             
-            response = chat_completion.choices[0].message.content
-            output_tokens_length = num_tokens_from_string(response)
-            print("output tokens length", output_tokens_length)
-            return response, input_tokens_length, output_tokens_length
+    def generate_text(self, prompt, semantic_text=None):
+        return self._generate(prompt, json_mode=True, semantic_text=semantic_text)
         
+    def generate_string_text(self, prompt, semantic_text=None):
+        return self._generate(prompt, json_mode=False, semantic_text=semantic_text)
+
+    async def agenerate_text(self, prompt, semantic_text=None):
+        """
+        Async variant of generate_text; does not block the event loop while waiting on the API.
+
+        prompt is a str, or PromptSegments to keep a static prefix cacheable by the provider.
+        semantic_text (e.g. the bare user question) lets the response cache match
+        near-identical questions when its semantic layer is enabled.
+        """
+        return await self._agenerate(prompt, json_mode=True, semantic_text=semantic_text)
+
+    async def agenerate_string_text(self, prompt, semantic_text=None):
+        """Async variant of generate_string_text."""
+        return await self._agenerate(prompt, json_mode=False, semantic_text=semantic_text)
+
+    async def astream_string_text(self, prompt):
+        """
+        Admit a plain-text completion through the gateway and open it as a stream.
+
+        Returns once the provider has accepted the request, so a shed or
+        failed call can still be answered with an error status before any
+        response is sent. Only opening the stream is retried.
+
+        Returns:
+            LLMStream: Yields the completion's events and holds one gateway slot until it ends or is closed.
+
+        Raises:
+            LLMUnavailableError: If the gateway sheds the call.
+            LLMError: If opening the stream still fails after retries.
+        """
+        estimated_tokens = self._estimated_tokens(prompt)
+        slot = AsyncExitStack()
+        await slot.enter_async_context(self.gateway.acquire(estimated_tokens))
+        try:
+            attempt = 0
+            while True:
+                try:
+                    stream = await self._aopen_stream({
+                        **self._completion_kwargs(prompt, json_mode=False),
+                        "stream": True,
+                        "stream_options": {"include_usage": True},
+                    })
+                    break
+                except Exception as e:
+                    delay = self.gateway.retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(delay)
         except Exception as e:
-            response = {"error": f"Error in invoking model! {str(e)}"}
-            print(response)
-            return response
-        
+            await slot.aclose()
+            print(f"Error in invoking model! {str(e)}")
+            raise LLMError(f"Error in invoking model! {str(e)}") from e
+        except BaseException:
+            await slot.aclose()
+            raise
+        return LLMStream(self, slot, stream, prompt, estimated_tokens)
+
     def generate_with_web_annotations(self, prompt, search_model="gpt-4o-mini-search-preview"):
-        try:
-            input_tokens_length = num_tokens_from_string(prompt)
-            print("input tokens length", input_tokens_length)
-            
-            chat_completion = self.client.chat.completions.create(
-                model=search_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                # Optionally enable search options 
-                # web_search_options={
-                #     "search_context_size": "low",
-                # },
-            )
-            
-            content = chat_completion.choices[0].message.content
-            annotations = chat_completion.choices[0].message.annotations
-            output_tokens_length = num_tokens_from_string(content)
-            print("output tokens length", output_tokens_length)
-            
-            return content, annotations, input_tokens_length, output_tokens_length
+        """
+        Answer with the provider's web-search model, admitted through the gateway like every other call.
+
+        Returns:
+            Tuple[str, list, int, int]: Response text, URL annotations, input tokens and output tokens.
 
+        Raises:
+            LLMUnavailableError: If the gateway sheds the call.
+            LLMError: If the call still fails after retries.
+        """
+        estimated_tokens = estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS
+
+        def request():
+            with span("llm"):
+                return self.client.chat.completions.create(
+                    model=search_model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    # Optionally enable search options 
+                    # web_search_options={
+                    #     "search_context_size": "low",
+                    # },
+                )
+
+        try:
+            chat_completion = self.gateway.call_sync(request, estimated_tokens)
+        except LLMError:
+            raise
         except Exception as e:
-            print(f"Error in generate_with_web_annotations: {str(e)}")
-            return {"error": str(e)}
\ No newline at end of file
+            raise LLMError(f"Error in generate_with_web_annotations: {str(e)}") from e
+
+        message = chat_completion.choices[0].message
+        usage = chat_completion.usage
+        if usage is not None and TOKEN_ACCOUNTING != "local":
+            input_tokens_length, output_tokens_length = usage.prompt_tokens, usage.completion_tokens
+        else:
+            input_tokens_length, output_tokens_length = num_tokens_from_string(prompt), num_tokens_from_string(message.content or "")
+        record_tokens(search_model, input_tokens_length, output_tokens_length)
+        self.gateway.settle(estimated_tokens, input_tokens_length + output_tokens_length)
+        return message.content, message.annotations, input_tokens_length, output_tokens_length
\ No newline at end of file
@@ -1,7 +1,11 @@
+from typing import List
 from pydantic import BaseModel
 
 class InputData(BaseModel):
     input_text: str
 
 class QueryNews(BaseModel):
-    query: str = "trump"
\ No newline at end of file
+    query: str = "trump"
+
+class QuestionBatch(BaseModel):
+    questions: List[str]
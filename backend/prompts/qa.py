@@ -1 +1,3 @@
-qa_prompt="You are a helpful assistant, given INFORMATION below, please answer the user's QUESTION. Please try to utilize the provided content! And answer the question in a simple and easy-to-understand way."
\ No newline at end of file
+qa_prompt="You are a helpful assistant, given INFORMATION below, please answer the user's QUESTION. Please try to utilize the provided content! And answer the question in a simple and easy-to-understand way."
+batch_qa_prompt="""You are a helpful assistant, given INFORMATION below, please answer each of the user's numbered QUESTIONS. Please try to utilize the provided content! And answer every question in a simple and easy-to-understand way.
+Respond with a JSON object of the form {"answers": [{"id": <question number>, "answer": "<answer>"}]}, with exactly one entry per question."""
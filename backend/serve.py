@@ -0,0 +1,38 @@
+"""
+Production entry point for server.py.
+
+Runs uvicorn with N worker processes. With more than one worker, every
+worker has to see the same balances and caches, so this switches the shared
+state to a store all workers can reach unless one is configured already:
+
+    python serve.py --workers 4                      # SQLite WAL files under ./data
+    SHARED_STATE=redis BALANCE_STORE=redis REDIS_URL=redis://cache:6379/0 python serve.py --workers 8
+
+The JSON balance store keeps balances in process memory and is refused here
+with more than one worker.
+"""
+import os
+import argparse
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", 1)))
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if os.getenv("BALANCE_STORE", "sqlite").lower() == "json":
+            parser.error("BALANCE_STORE=json is not safe with more than one worker; use sqlite or redis")
+        # Workers inherit this environment, so they all pick the same shared store
+        os.environ.setdefault("SHARED_STATE", "sqlite")
+
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+JOURNAL_FILE = "./data/balance_journal.db"
+SNAPSHOT_INTERVAL = 100
+EXPORT_COLUMNS = ["seq", "ts", "user_id", "token_symbol", "delta", "balance"]
+
+# (user_id, token_symbol, previous balance, new balance or None when deleted)
+Change = Tuple[str, str, float, Optional[float]]
+
+
+class BalanceJournal:
+    """
+    Append-only log of balance changes with periodic per-user snapshots.
+
+    Each entry holds the change and the resulting balance of one (user, token),
+    numbered by a global sequence. Every `snapshot_interval` entries of a user,
+    their full balances are snapshotted, so rebuilding a balance at any point
+    reads one snapshot and at most `snapshot_interval` entries.
+
+    The SQLite balance store keeps the journal in its own database and writes
+    it in the same transaction as the balances, and the Redis store uses
+    RedisBalanceJournal; other stores use a separate file written while their
+    mutation lock is still held.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE, connection: Optional[Callable[[], sqlite3.Connection]] = None,
+                 snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self._local = threading.local()
+        # Entries this process wrote per user since it last checked for a snapshot
+        self._unchecked: Dict[str, int] = {}
+        self._connection = connection or self._own_connection
+        if connection is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS balance_journal (
+                seq INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                user_id TEXT NOT NULL,
+                token_symbol TEXT NOT NULL,
+                delta REAL NOT NULL,
+                balance REAL
+            );
+            CREATE INDEX IF NOT EXISTS balance_journal_user ON balance_journal (user_id, seq);
+            CREATE TABLE IF NOT EXISTS balance_snapshots (
+                user_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                balances TEXT NOT NULL,
+                PRIMARY KEY (user_id, seq)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _own_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, changes: List[Change], current_balances: Callable[[str], Dict[str, float]]):
+        """
+        Record the changes of one committed mutation.
+
+        Args:
+            changes (List[Change]): (user_id, token_symbol, previous, new) in the order they were made.
+            current_balances (Callable): Returns a user's balances after the mutation, used for snapshots.
+        """
+        if not changes:
+            return
+        now = time.time()
+        conn = self._connection()
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO balance_journal (ts, user_id, token_symbol, delta, balance) VALUES (?, ?, ?, ?, ?)",
+                [(now, user_id, token_symbol, (new or 0.0) - previous, new)
+                 for user_id, token_symbol, previous, new in changes],
+            )
+            for user_id in dict.fromkeys(change[0] for change in changes):
+                unchecked = self._unchecked.get(user_id, self.snapshot_interval - 1) + sum(change[0] == user_id for change in changes)
+                if unchecked >= self.snapshot_interval:
+                    self._maybe_snapshot(conn, user_id, now, current_balances)
+                    unchecked = 0
+                self._unchecked[user_id] = unchecked
+        except BaseException:
+            if own_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        if own_transaction:
+            conn.execute("COMMIT")
+
+    def _maybe_snapshot(self, conn, user_id, now, current_balances):
+        # Other workers append too, so the database decides; any run of
+        # workers * snapshot_interval entries of a user triggers a check.
+        last_snapshot = self._snapshot_before(conn, user_id, None)[0]
+        seq, count = conn.execute(
+            "SELECT MAX(seq), COUNT(*) FROM balance_journal WHERE user_id = ? AND seq > ?",
+            (user_id, last_snapshot),
+        ).fetchone()
+        if count >= self.snapshot_interval:
+            conn.execute(
+                "INSERT INTO balance_snapshots (user_id, seq, ts, balances) VALUES (?, ?, ?, ?)",
+                (user_id, seq, now, json.dumps(current_balances(user_id))),
+            )
+
+    def _snapshot_before(self, conn, user_id: str, seq: Optional[int]) -> Tuple[int, Dict[str, float]]:
+        row = conn.execute(
+            "SELECT seq, balances FROM balance_snapshots WHERE user_id = ? AND seq <= ? ORDER BY seq DESC LIMIT 1",
+            (user_id, seq if seq is not None else 2 ** 63 - 1),
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else (0, {})
+
+    def balances_at(self, user_id: str, ts: Optional[float] = None, seq: Optional[int] = None) -> Dict[str, float]:
+        """
+        Rebuild a user's balances as of a time or journal sequence number.
+
+        Args:
+            user_id (str): User identifier
+            ts (float, optional): Unix time; changes after it are ignored.
+            seq (int, optional): Last journal entry to include.
+
+        Returns:
+            Dict[str, float]: Balances at that point, from the nearest snapshot plus the entries after it.
+        """
+        conn = self._connection()
+        if ts is not None:
+            # Entries are appended in time order, so scan back from the newest
+            row = conn.execute(
+                "SELECT seq FROM balance_journal WHERE user_id = ? AND ts <= ? ORDER BY seq DESC LIMIT 1", (user_id, ts)
+            ).fetchone()
+            seq = min(seq, row[0] if row else 0) if seq is not None else (row[0] if row else 0)
+        snapshot_seq, balances = self._snapshot_before(conn, user_id, seq)
+        rows = conn.execute(
+            "SELECT token_symbol, balance FROM balance_journal WHERE user_id = ? AND seq > ? AND seq <= ? ORDER BY seq",
+            (user_id, snapshot_seq, seq if seq is not None else 2 ** 63 - 1),
+        )
+        for token_symbol, balance in rows:
+            if balance is None:
+                balances.pop(token_symbol, None)
+            else:
+                balances[token_symbol] = balance
+        return balances
+
+    def entries(self, user_id: Optional[str] = None, after: int = 0, limit: int = 100,
+                until: Optional[float] = None) -> List[Dict]:
+        """One page of entries with seq > after and, if given, ts <= until, oldest first, for one user or everyone."""
+        query = "SELECT seq, ts, user_id, token_symbol, delta, balance FROM balance_journal WHERE seq > ?"
+        params: List = [after]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        if until is not None:
+            query += " AND ts <= ?"
+            params.append(until)
+        rows = self._connection().execute(query + " ORDER BY seq LIMIT ?", params + [limit]).fetchall()
+        return [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+
+    def iter_entries(self, user_id: Optional[str] = None, after: int = 0, page_size: int = 1000,
+                     until: Optional[float] = None) -> Iterator[Dict]:
+        """Every entry after a cursor, up to time until if given, read a page at a time."""
+        for page in self._pages(user_id, after, page_size, until):
+            yield from page
+
+    def export(self, path: str, user_id: Optional[str] = None, page_size: int = 50000) -> int:
+        """
+        Write the journal to a Parquet file, or CSV if the path ends in .csv.
+
+        Parquet needs the optional pyarrow package. Entries are written one
+        row group per page, so memory stays bounded by page_size.
+
+        Returns:
+            int: Number of entries written.
+        """
+        pages = self._pages(user_id, 0, page_size)
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_COLUMNS)
+                count = 0
+                for page in pages:
+                    writer.writerows([entry[column] for column in EXPORT_COLUMNS] for entry in page)
+                    count += len(page)
+                return count
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow); export to a .csv path instead")
+        schema = pa.schema([
+            ("seq", pa.int64()), ("ts", pa.float64()), ("user_id", pa.string()),
+            ("token_symbol", pa.string()), ("delta", pa.float64()), ("balance", pa.float64()),
+        ])
+        count = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            for page in pages:
+                columns = {column: [entry[column] for entry in page] for column in EXPORT_COLUMNS}
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                count += len(page)
+        return count
+
+    def _pages(self, user_id, after, page_size, until=None) -> Iterator[List[Dict]]:
+        while True:
+            page = self.entries(user_id, after, page_size, until)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = page[-1]["seq"]
+
+
+# Appends one mutation's entries, numbering them when the script runs, i.e. in commit order.
+# KEYS: sequence counter, global stream, one user stream per change, then a snapshot
+# set and snapshot-time set per snapshot. ARGV: ts, change count, snapshot count, then
+# (user_id, token_symbol, delta, balance) per change and (user_id, balances JSON) per snapshot.
+APPEND_SCRIPT = """
+local ts, changes, snapshots = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local last_seq = {}
+for i = 1, changes do
+    local arg = 3 + (i - 1) * 4
+    local seq = redis.call('INCR', KEYS[1])
+    local fields = {'ts', ts, 'user_id', ARGV[arg + 1], 'token_symbol', ARGV[arg + 2],
+                    'delta', ARGV[arg + 3], 'balance', ARGV[arg + 4]}
+    redis.call('XADD', KEYS[2], seq .. '-0', unpack(fields))
+    redis.call('XADD', KEYS[2 + i], seq .. '-0', unpack(fields))
+    last_seq[ARGV[arg + 1]] = seq
+end
+for j = 1, snapshots do
+    local arg = 3 + changes * 4 + (j - 1) * 2
+    local key = 2 + changes + (j - 1) * 2
+    local seq = last_seq[ARGV[arg + 1]]
+    redis.call('ZADD', KEYS[key + 1], seq, '{"seq": ' .. seq .. ', "ts": ' .. ts .. ', "balances": ' .. ARGV[arg + 2] .. '}')
+    redis.call('ZADD', KEYS[key + 2], ts, seq)
+end
+"""
+
+
+class RedisBalanceJournal(BalanceJournal):
+    """
+    BalanceJournal kept on the Redis-protocol server of RedisBalanceStore, shared by every host.
+
+    Entries go to a stream for everyone and one per user, with the global
+    sequence number as stream ID, so cursors work as in the SQLite journal.
+    Snapshots are stored per user in a sorted set scored by sequence number,
+    plus one scored by time for as-of lookups. Each mutation's entries are
+    written by one Lua script that also numbers them, so sequence numbers
+    follow commit order even when mutations of different users run at once.
+    With `queue`, the script is handed to the balance store to run in the
+    same MULTI/EXEC as the balances.
+    """
+
+    def __init__(self, client, queue: Optional[Callable[..., None]] = None,
+                 snapshot_interval: int = SNAPSHOT_INTERVAL, prefix: str = "balance_journal"):
+        self.client = client
+        self.queue = queue
+        self.snapshot_interval = snapshot_interval
+        self.prefix = prefix
+        self._unchecked: Dict[str, int] = {}
+
+    def _stream(self, user_id: Optional[str]) -> str:
+        return f"{self.prefix}:all" if user_id is None else f"{self.prefix}:user:{user_id}"
+
+    def _snapshots(self, user_id: str) -> str:
+        return f"{self.prefix}:snapshots:{user_id}"
+
+    def _snapshot_times(self, user_id: str) -> str:
+        return f"{self.prefix}:snapshot_ts:{user_id}"
+
+    def append(self, changes: List[Change], current_balances: Callable[[str], Dict[str, float]]):
+        if not changes:
+            return
+        keys = [f"{self.prefix}:seq", self._stream(None)]
+        args: List = [repr(time.time()), len(changes), 0]
+        for user_id, token_symbol, previous, new in changes:
+            keys.append(self._stream(user_id))
+            # Redis fields cannot hold None, so a deleted balance is stored as ""
+            args += [user_id, token_symbol, repr((new or 0.0) - previous), "" if new is None else repr(float(new))]
+        for user_id in dict.fromkeys(change[0] for change in changes):
+            pending = sum(change[0] == user_id for change in changes)
+            unchecked = self._unchecked.get(user_id, self.snapshot_interval - 1) + pending
+            if unchecked >= self.snapshot_interval:
+                unchecked = 0
+                if self._due_for_snapshot(user_id, pending):
+                    keys += [self._snapshots(user_id), self._snapshot_times(user_id)]
+                    args += [user_id, json.dumps(current_balances(user_id))]
+                    args[2] += 1
+            self._unchecked[user_id] = unchecked
+
+        if self.queue is not None:
+            self.queue("eval", APPEND_SCRIPT, len(keys), *keys, *args)
+        else:
+            self.client.eval(APPEND_SCRIPT, len(keys), *keys, *args)
+
+    def _due_for_snapshot(self, user_id: str, pending: int) -> bool:
+        # Other hosts append too, so count what is in Redis since the last snapshot
+        last = self.client.zrevrange(self._snapshots(user_id), 0, 0, withscores=True)
+        after = int(last[0][1]) if last else 0
+        stored = self.client.xrange(self._stream(user_id), min=f"{after + 1}-0", count=self.snapshot_interval)
+        return len(stored) + pending >= self.snapshot_interval
+
+    def _entry(self, stream_id: str, fields: Dict[str, str]) -> Dict:
+        return {
+            "seq": int(stream_id.split("-")[0]),
+            "ts": float(fields["ts"]),
+            "user_id": fields["user_id"],
+            "token_symbol": fields["token_symbol"],
+            "delta": float(fields["delta"]),
+            "balance": float(fields["balance"]) if fields["balance"] != "" else None,
+        }
+
+    def balances_at(self, user_id: str, ts: Optional[float] = None, seq: Optional[int] = None) -> Dict[str, float]:
+        # Latest snapshot within both bounds; seq and ts grow together, so the lower bound satisfies both
+        bound = seq if seq is not None else "+inf"
+        if ts is not None:
+            found = self.client.zrevrangebyscore(self._snapshot_times(user_id), ts, "-inf", start=0, num=1)
+            before_ts = int(found[0]) if found else 0
+            bound = before_ts if seq is None else min(seq, before_ts)
+        found = self.client.zrevrangebyscore(self._snapshots(user_id), bound, "-inf", start=0, num=1)
+        snapshot = json.loads(found[0]) if found else {"seq": 0, "balances": {}}
+        balances = snapshot["balances"]
+
+        after = snapshot["seq"]
+        while True:
+            page = self.client.xrange(self._stream(user_id), min=f"{after + 1}-0", count=self.snapshot_interval)
+            for stream_id, fields in page:
+                entry = self._entry(stream_id, fields)
+                if (seq is not None and entry["seq"] > seq) or (ts is not None and entry["ts"] > ts):
+                    return balances
+                if entry["balance"] is None:
+                    balances.pop(entry["token_symbol"], None)
+                else:
+                    balances[entry["token_symbol"]] = entry["balance"]
+                after = entry["seq"]
+            if len(page) < self.snapshot_interval:
+                return balances
+
+    def entries(self, user_id: Optional[str] = None, after: int = 0, limit: int = 100,
+                until: Optional[float] = None) -> List[Dict]:
+        page = [self._entry(stream_id, fields)
+                for stream_id, fields in self.client.xrange(self._stream(user_id), min=f"{after + 1}-0", count=limit)]
+        if until is not None:
+            # Stop at the first later entry, as balances_at does
+            for index, entry in enumerate(page):
+                if entry["ts"] > until:
+                    return page[:index]
+        return page
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the balance journal for analytics")
+    parser.add_argument("output", help="destination .parquet (needs pyarrow) or .csv file")
+    parser.add_argument("--journal", default=None, help="journal database, defaults to the configured balance store's")
+    parser.add_argument("--user", default=None, help="only this user's entries")
+    args = parser.parse_args()
+
+    if args.journal:
+        journal = BalanceJournal(args.journal)
+    else:
+        from utils.balance_store import create_balance_store
+        journal = create_balance_store().journal
+        if journal is None:
+            raise SystemExit("BALANCE_JOURNAL is off")
+    count = journal.export(args.output, args.user)
+    print(f"Exported {count} journal entries to {args.output}")
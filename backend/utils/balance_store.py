@@ -0,0 +1,604 @@
+import os
+import json
+import sqlite3
+import zlib
+import threading
+from contextlib import contextmanager, ExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.balance_journal import BalanceJournal, RedisBalanceJournal, JOURNAL_FILE, SNAPSHOT_INTERVAL
+from utils.metrics import log_event
+
+DATA_DIR = "./data"
+JSON_BALANCE_FILE = "./data/token_balances.json"
+SQLITE_BALANCE_FILE = "./data/token_balances.db"
+REDIS_BALANCE_URL = "redis://localhost:6379/0"
+LOCK_STRIPES = 64
+
+
+class InsufficientBalanceError(Exception):
+    """Raised when a decrement would take a balance below zero."""
+
+    def __init__(self, current_balance: float, requested: float):
+        self.current_balance = current_balance
+        self.requested = requested
+        super().__init__(f"Insufficient balance. Current: {current_balance}, Requested: {requested}")
+
+
+class BalanceBatchError(Exception):
+    """Raised when one operation of a batch fails; none of the batch is applied."""
+
+    def __init__(self, index: int, message: str):
+        self.index = index
+        super().__init__(f"Operation {index} failed: {message}")
+
+
+class BalanceStore:
+    """Interface implemented by every balance storage backend."""
+
+    def __init__(self):
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.journal: Optional[BalanceJournal] = None
+        self._journal_local = threading.local()
+
+    def open_journal(self, path: Optional[str] = None, snapshot_interval: int = SNAPSHOT_INTERVAL) -> BalanceJournal:
+        """Start recording every balance change in a BalanceJournal."""
+        self.journal = BalanceJournal(path or JOURNAL_FILE, snapshot_interval=snapshot_interval)
+        return self.journal
+
+    def _stripe_index(self, user_id: str, token_symbol: str) -> int:
+        key = f"{user_id}\x00{token_symbol}".encode("utf-8")
+        return zlib.crc32(key) % LOCK_STRIPES
+
+    def _stripe(self, user_id: str, token_symbol: str) -> threading.Lock:
+        """Lock guarding one (user, token) pair; unrelated pairs rarely share a stripe."""
+        return self._stripes[self._stripe_index(user_id, token_symbol)]
+
+    @contextmanager
+    def _mutation(self, *user_ids: str):
+        """
+        Scope of a single read-modify-write of the given users' balances.
+
+        Backends override it to add cross-process atomicity.
+        """
+        yield
+
+    @contextmanager
+    def _journaled(self):
+        """Collect the changes of the outermost mutation and journal them once it has succeeded."""
+        if self.journal is None:
+            yield
+            return
+        self._journal_local.changes = []
+        try:
+            yield
+            changes = self._journal_local.changes
+        finally:
+            self._journal_local.changes = None
+        self.journal.append(changes, self.get_user_balances)
+
+    def _record(self, user_id: str, token_symbol: str, previous: float, new: Optional[float]):
+        """Note one change for the journal; new is None when the balance was deleted."""
+        self._journal_local.changes.append((user_id, token_symbol, previous, new))
+
+    def adjust_balance(self, user_id: str, token_symbol: str, delta: float) -> Tuple[float, float]:
+        """
+        Atomically add delta to a balance.
+
+        Args:
+            user_id (str): User identifier
+            token_symbol (str): Token symbol
+            delta (float): Amount to add, negative to subtract
+
+        Returns:
+            Tuple[float, float]: Previous and new balance.
+
+        Raises:
+            InsufficientBalanceError: If the new balance would be negative.
+        """
+        with self._stripe(user_id, token_symbol), self._mutation(user_id):
+            return self._adjust_locked(user_id, token_symbol, delta)
+
+    def _adjust_locked(self, user_id: str, token_symbol: str, delta: float) -> Tuple[float, float]:
+        current_balance = self.get_balance(user_id, token_symbol)
+        if delta < 0 and current_balance < -delta:
+            raise InsufficientBalanceError(current_balance, -delta)
+        new_balance = current_balance + delta
+        self.set_balance(user_id, token_symbol, new_balance)
+        return current_balance, new_balance
+
+    def increment(self, user_id: str, token_symbol: str, amount: float) -> Tuple[float, float]:
+        return self.adjust_balance(user_id, token_symbol, amount)
+
+    def decrement(self, user_id: str, token_symbol: str, amount: float) -> Tuple[float, float]:
+        return self.adjust_balance(user_id, token_symbol, -amount)
+
+    def apply_batch(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply many set/increment/decrement operations as one all-or-nothing commit.
+
+        Args:
+            operations (List[Dict[str, Any]]): Each item has op ("set", "increment" or "decrement"),
+                user_id, token_symbol and amount (the new balance for "set").
+
+        Returns:
+            List[Dict[str, Any]]: Per-operation previous and new balances, in input order.
+
+        Raises:
+            BalanceBatchError: If any operation fails. Nothing is written in that case.
+        """
+        stripe_indexes = sorted({self._stripe_index(op["user_id"], op["token_symbol"]) for op in operations})
+        with ExitStack() as stack:
+            # Stripes are always taken in ascending order so concurrent batches cannot deadlock.
+            for stripe_index in stripe_indexes:
+                stack.enter_context(self._stripes[stripe_index])
+            stack.enter_context(self._mutation(*{op["user_id"] for op in operations}))
+
+            results = []
+            for index, op in enumerate(operations):
+                user_id, token_symbol, amount = op["user_id"], op["token_symbol"], op["amount"]
+                try:
+                    if op["op"] == "set":
+                        previous_balance, new_balance = self.get_balance(user_id, token_symbol), amount
+                        self.set_balance(user_id, token_symbol, amount)
+                    elif op["op"] == "increment":
+                        previous_balance, new_balance = self._adjust_locked(user_id, token_symbol, amount)
+                    elif op["op"] == "decrement":
+                        previous_balance, new_balance = self._adjust_locked(user_id, token_symbol, -amount)
+                    else:
+                        raise ValueError(f"Unknown operation: {op['op']}")
+                except (InsufficientBalanceError, ValueError) as e:
+                    raise BalanceBatchError(index, str(e))
+                results.append({
+                    "op": op["op"],
+                    "user_id": user_id,
+                    "token_symbol": token_symbol,
+                    "previous_balance": previous_balance,
+                    "new_balance": new_balance,
+                })
+            return results
+
+    def get_user_balances(self, user_id: str) -> Dict[str, float]:
+        raise NotImplementedError
+
+    def get_balance(self, user_id: str, token_symbol: str) -> float:
+        return self.get_user_balances(user_id).get(token_symbol, 0.0)
+
+    def set_balance(self, user_id: str, token_symbol: str, balance: float):
+        raise NotImplementedError
+
+    def delete_balance(self, user_id: str, token_symbol: str) -> bool:
+        """Remove one token for a user. Returns False if it did not exist."""
+        raise NotImplementedError
+
+    def delete_user(self, user_id: str) -> bool:
+        """Remove every token for a user. Returns False if the user did not exist."""
+        raise NotImplementedError
+
+    def all_balances(self) -> Dict[str, Dict[str, float]]:
+        raise NotImplementedError
+
+
+class JSONBalanceStore(BalanceStore):
+    """
+    Legacy backend that keeps every balance in a single JSON file.
+
+    The file is parsed once and kept in memory, so reads no longer touch disk,
+    but every write still rewrites the whole file. Only safe with a single worker process.
+    """
+
+    def __init__(self, path: str = JSON_BALANCE_FILE):
+        super().__init__()
+        self.path = path
+        self._lock = threading.RLock()
+        self._balances = self._load()
+        self._in_mutation = False
+
+    @contextmanager
+    def _mutation(self, *user_ids: str):
+        """Defer the file rewrite to the end of the outermost mutation and roll back on error."""
+        with self._lock:
+            if self._in_mutation:
+                yield
+                return
+            snapshot = {user_id: dict(tokens) for user_id, tokens in self._balances.items()}
+            self._in_mutation = True
+            with self._journaled():
+                try:
+                    yield
+                except BaseException:
+                    self._balances = snapshot
+                    raise
+                finally:
+                    self._in_mutation = False
+                self._save()
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                return {}
+        return {}
+
+    def _save(self):
+        if self._in_mutation:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._balances, f)
+        os.replace(tmp_path, self.path)
+
+    def get_user_balances(self, user_id: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._balances.get(user_id, {}))
+
+    def set_balance(self, user_id: str, token_symbol: str, balance: float):
+        with self._mutation():
+            user_balances = self._balances.setdefault(user_id, {})
+            if self.journal is not None:
+                self._record(user_id, token_symbol, user_balances.get(token_symbol, 0.0), balance)
+            user_balances[token_symbol] = balance
+
+    def delete_balance(self, user_id: str, token_symbol: str) -> bool:
+        with self._mutation():
+            user_balances = self._balances.get(user_id, {})
+            if token_symbol not in user_balances:
+                return False
+            if self.journal is not None:
+                self._record(user_id, token_symbol, user_balances[token_symbol], None)
+            del user_balances[token_symbol]
+            return True
+
+    def delete_user(self, user_id: str) -> bool:
+        with self._mutation():
+            if user_id not in self._balances:
+                return False
+            if self.journal is not None:
+                for token_symbol, balance in self._balances[user_id].items():
+                    self._record(user_id, token_symbol, balance, None)
+            del self._balances[user_id]
+            return True
+
+    def all_balances(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {user_id: dict(tokens) for user_id, tokens in self._balances.items()}
+
+
+class SQLiteBalanceStore(BalanceStore):
+    """
+    Balance backend on an embedded SQLite database in WAL mode.
+
+    Balances are stored one row per (user_id, token_symbol), so reads are an
+    index lookup and writes only touch the rows that changed. Mutations run
+    inside BEGIN IMMEDIATE transactions, which makes them atomic across every
+    worker process sharing the database file.
+    """
+
+    def __init__(self, path: str = SQLITE_BALANCE_FILE):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._mutation() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS balances (
+                    user_id TEXT NOT NULL,
+                    token_symbol TEXT NOT NULL,
+                    balance REAL NOT NULL,
+                    PRIMARY KEY (user_id, token_symbol)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection owned by the calling thread, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _mutation(self, *user_ids: str):
+        """Hold the database write lock for a whole read-modify-write; nested calls join the outer one."""
+        conn = self._connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # The journal is written inside the same transaction as the balances
+            with self._journaled():
+                yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def open_journal(self, path: Optional[str] = None, snapshot_interval: int = SNAPSHOT_INTERVAL) -> BalanceJournal:
+        """Record balance changes in this database, or in a separate file if path is given."""
+        if path:
+            return super().open_journal(path, snapshot_interval)
+        self.journal = BalanceJournal(self.path, connection=self._connection, snapshot_interval=snapshot_interval)
+        return self.journal
+
+    def import_legacy_json(self, json_path: str = JSON_BALANCE_FILE) -> int:
+        """
+        Copy a legacy token_balances.json into this database the first time it is opened.
+
+        Runs once per database: the import is only made while no balance has
+        been stored yet, and PRAGMA user_version marks it as done in the same
+        transaction, so concurrent workers import at most once and a database
+        emptied later is not refilled.
+
+        Returns:
+            int: Number of (user, token) balances copied.
+        """
+        with self._mutation() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= 1:
+                return 0
+            count = 0
+            if os.path.exists(json_path) and conn.execute("SELECT 1 FROM balances LIMIT 1").fetchone() is None:
+                count = migrate_json_balances(self, json_path)
+            conn.execute("PRAGMA user_version = 1")
+        return count
+
+    def get_user_balances(self, user_id: str) -> Dict[str, float]:
+        rows = self._connection().execute(
+            "SELECT token_symbol, balance FROM balances WHERE user_id = ?",
+            (user_id,),
+        ).fetchall()
+        return {token_symbol: balance for token_symbol, balance in rows}
+
+    def get_balance(self, user_id: str, token_symbol: str) -> float:
+        row = self._connection().execute(
+            "SELECT balance FROM balances WHERE user_id = ? AND token_symbol = ?",
+            (user_id, token_symbol),
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def set_balance(self, user_id: str, token_symbol: str, balance: float):
+        with self._mutation() as conn:
+            if self.journal is not None:
+                self._record(user_id, token_symbol, self.get_balance(user_id, token_symbol), balance)
+            conn.execute(
+                "INSERT OR REPLACE INTO balances (user_id, token_symbol, balance) VALUES (?, ?, ?)",
+                (user_id, token_symbol, balance),
+            )
+
+    def delete_balance(self, user_id: str, token_symbol: str) -> bool:
+        with self._mutation() as conn:
+            cursor = conn.execute(
+                "DELETE FROM balances WHERE user_id = ? AND token_symbol = ? RETURNING balance",
+                (user_id, token_symbol),
+            )
+            deleted = cursor.fetchall()
+            if deleted and self.journal is not None:
+                self._record(user_id, token_symbol, deleted[0][0], None)
+        return bool(deleted)
+
+    def delete_user(self, user_id: str) -> bool:
+        with self._mutation() as conn:
+            deleted = conn.execute(
+                "DELETE FROM balances WHERE user_id = ? RETURNING token_symbol, balance", (user_id,)
+            ).fetchall()
+            if self.journal is not None:
+                for token_symbol, balance in deleted:
+                    self._record(user_id, token_symbol, balance, None)
+        return bool(deleted)
+
+    def all_balances(self) -> Dict[str, Dict[str, float]]:
+        balances: Dict[str, Dict[str, float]] = {}
+        rows = self._connection().execute(
+            "SELECT user_id, token_symbol, balance FROM balances"
+        ).fetchall()
+        for user_id, token_symbol, balance in rows:
+            balances.setdefault(user_id, {})[token_symbol] = balance
+        return balances
+
+
+class RedisBalanceStore(BalanceStore):
+    """
+    Balance backend on a Redis-protocol server, for workers spread across hosts.
+
+    Each user is a hash of token -> balance under "balances:<user_id>", and
+    "balances:users" lists every user. Mutations hold a server-side lock per
+    user they touch, so writes to different users proceed in parallel, and
+    buffer their writes, which are committed in one MULTI/EXEC at the end of
+    the outermost mutation or dropped if it fails, so batches stay all-or-nothing.
+    """
+
+    def __init__(self, url: str = REDIS_BALANCE_URL):
+        super().__init__()
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._local = threading.local()
+
+    def _user_key(self, user_id: str) -> str:
+        return f"balances:{user_id}"
+
+    @contextmanager
+    def _mutation(self, *user_ids: str):
+        """Hold the users' locks for a whole read-modify-write; nested calls join the outer one."""
+        if getattr(self._local, "pending", None) is not None:
+            yield
+            return
+        with ExitStack() as locks:
+            # One lock per user, taken in sorted order so concurrent batches cannot deadlock
+            for user_id in sorted(set(user_ids)):
+                locks.enter_context(self.client.lock(f"balance_locks:{user_id}", timeout=30, blocking_timeout=30))
+            self._local.pending = []
+            self._local.overlay = {}
+            try:
+                # A Redis journal queues its entries too, so they commit with the balances
+                with self._journaled():
+                    yield
+                if self._local.pending:
+                    pipe = self.client.pipeline(transaction=True)
+                    for command, args in self._local.pending:
+                        getattr(pipe, command)(*args)
+                    pipe.execute()
+            finally:
+                self._local.pending = None
+                self._local.overlay = None
+
+    def _queue(self, command: str, *args):
+        self._local.pending.append((command, args))
+
+    def open_journal(self, path: Optional[str] = None, snapshot_interval: int = SNAPSHOT_INTERVAL) -> BalanceJournal:
+        """Record balance changes on the Redis server, so every host sees the same journal."""
+        if path:
+            raise ValueError("BALANCE_JOURNAL_PATH would give each host its own journal; the Redis store keeps it on the server")
+        self.journal = RedisBalanceJournal(self.client, queue=self._queue, snapshot_interval=snapshot_interval)
+        return self.journal
+
+    def get_user_balances(self, user_id: str) -> Dict[str, float]:
+        balances = {token: float(value) for token, value in self.client.hgetall(self._user_key(user_id)).items()}
+        for (overlay_user, token_symbol), value in (getattr(self._local, "overlay", None) or {}).items():
+            if overlay_user != user_id:
+                continue
+            if value is None:
+                balances.pop(token_symbol, None)
+            else:
+                balances[token_symbol] = value
+        return balances
+
+    def get_balance(self, user_id: str, token_symbol: str) -> float:
+        overlay = getattr(self._local, "overlay", None) or {}
+        if (user_id, token_symbol) in overlay:
+            return overlay[(user_id, token_symbol)] or 0.0
+        value = self.client.hget(self._user_key(user_id), token_symbol)
+        return float(value) if value is not None else 0.0
+
+    def set_balance(self, user_id: str, token_symbol: str, balance: float):
+        with self._mutation(user_id):
+            if self.journal is not None:
+                self._record(user_id, token_symbol, self.get_balance(user_id, token_symbol), balance)
+            self._queue("hset", self._user_key(user_id), token_symbol, repr(float(balance)))
+            self._queue("sadd", "balances:users", user_id)
+            self._local.overlay[(user_id, token_symbol)] = balance
+
+    def delete_balance(self, user_id: str, token_symbol: str) -> bool:
+        with self._mutation(user_id):
+            user_balances = self.get_user_balances(user_id)
+            if token_symbol not in user_balances:
+                return False
+            if self.journal is not None:
+                self._record(user_id, token_symbol, user_balances[token_symbol], None)
+            self._queue("hdel", self._user_key(user_id), token_symbol)
+            self._local.overlay[(user_id, token_symbol)] = None
+            return True
+
+    def delete_user(self, user_id: str) -> bool:
+        with self._mutation(user_id):
+            tokens = self.get_user_balances(user_id)
+            if not tokens and not self.client.sismember("balances:users", user_id):
+                return False
+            self._queue("delete", self._user_key(user_id))
+            self._queue("srem", "balances:users", user_id)
+            for token_symbol, balance in tokens.items():
+                if self.journal is not None:
+                    self._record(user_id, token_symbol, balance, None)
+                self._local.overlay[(user_id, token_symbol)] = None
+            return True
+
+    def all_balances(self) -> Dict[str, Dict[str, float]]:
+        return {user_id: self.get_user_balances(user_id) for user_id in self.client.smembers("balances:users")}
+
+
+STORE_BACKENDS = {
+    "json": (JSONBalanceStore, JSON_BALANCE_FILE),
+    "sqlite": (SQLiteBalanceStore, SQLITE_BALANCE_FILE),
+    "redis": (RedisBalanceStore, REDIS_BALANCE_URL),
+}
+
+_store: Optional[BalanceStore] = None
+_store_lock = threading.Lock()
+
+
+def create_balance_store(
+    backend: Optional[str] = None, path: Optional[str] = None, import_legacy: bool = True
+) -> BalanceStore:
+    """
+    Build a balance store from its backend name.
+
+    Args:
+        backend (str, optional): "sqlite", "redis" or "json". Defaults to the BALANCE_STORE env var, then "sqlite".
+        path (str, optional): Storage file, or server URL for "redis". Defaults to BALANCE_STORE_PATH,
+            then REDIS_URL for "redis", then the backend's default.
+        import_legacy (bool): Import the legacy JSON file into a new SQLite store. The migration CLI
+            turns this off because it copies its own --source file.
+
+    Returns:
+        BalanceStore: The configured store, journaling its changes unless BALANCE_JOURNAL is "off".
+            A new SQLite store imports the legacy JSON file (BALANCE_JSON_PATH) on first start.
+    """
+    backend = (backend or os.getenv("BALANCE_STORE", "sqlite")).lower()
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"Unknown balance store backend: {backend}")
+    store_class, default_path = STORE_BACKENDS[backend]
+    if backend == "redis":
+        default_path = os.getenv("REDIS_URL", default_path)
+    store = store_class(path or os.getenv("BALANCE_STORE_PATH") or default_path)
+    if os.getenv("BALANCE_JOURNAL", "on").lower() != "off":
+        store.open_journal(
+            os.getenv("BALANCE_JOURNAL_PATH"),
+            snapshot_interval=int(os.getenv("BALANCE_SNAPSHOT_INTERVAL", SNAPSHOT_INTERVAL)),
+        )
+    if import_legacy and isinstance(store, SQLiteBalanceStore):
+        json_path = os.getenv("BALANCE_JSON_PATH", JSON_BALANCE_FILE)
+        count = store.import_legacy_json(json_path)
+        if count:
+            log_event("balance_import", source=json_path, dest=store.path, balances=count)
+    return store
+
+
+def get_balance_store() -> BalanceStore:
+    """Return the process-wide balance store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_balance_store()
+    return _store
+
+
+def migrate_json_balances(store: BalanceStore, json_path: str = JSON_BALANCE_FILE) -> int:
+    """
+    Copy every balance from a legacy JSON file into another store.
+
+    Args:
+        store (BalanceStore): Destination store.
+        json_path (str): Legacy token_balances.json file.
+
+    Returns:
+        int: Number of (user, token) balances copied.
+    """
+    operations = [
+        {"op": "set", "user_id": user_id, "token_symbol": token_symbol, "amount": balance}
+        for user_id, tokens in JSONBalanceStore(json_path).all_balances().items()
+        for token_symbol, balance in tokens.items()
+    ]
+    store.apply_batch(operations)
+    return len(operations)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate token_balances.json into another balance store")
+    parser.add_argument("--source", default=JSON_BALANCE_FILE, help="legacy JSON balance file")
+    parser.add_argument("--backend", default="sqlite", help="destination backend")
+    parser.add_argument("--dest", default=None, help="destination file")
+    args = parser.parse_args()
+
+    destination = create_balance_store(args.backend, args.dest, import_legacy=False)
+    count = migrate_json_balances(destination, args.source)
+    print(f"Migrated {count} balances from {args.source} to {args.backend} store")
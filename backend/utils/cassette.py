@@ -0,0 +1,178 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.metrics import CASSETTE_EVENTS
+
+CASSETTE_FILE = "./data/cassette.jsonl.gz"
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when the cassette has no recording of an upstream request."""
+
+
+def request_key(request: Any) -> str:
+    """Stable digest of an upstream request, so cassettes hold hashes rather than whole prompts."""
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+class Cassette:
+    """
+    Records upstream calls (OpenAI, Serper) and inbound requests to a JSONL file, and replays them.
+
+    In "record" mode every upstream response is stored with its latency under
+    a hash of the request, and every inbound request with its arrival offset.
+    In "replay" mode upstream calls are answered from the file after sleeping
+    the recorded latency divided by `speedup`; repeated requests get their
+    recordings in order, wrapping around. Paths ending in .gz are gzipped.
+    """
+
+    def __init__(self, path: str = CASSETTE_FILE, mode: str = "replay", speedup: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speedup = speedup
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._file = None
+        self._entries: Dict[str, List[Dict]] = {}
+        self._positions: Dict[str, int] = {}
+        self.requests: List[Dict] = []
+        if mode == "replay":
+            self._load()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        with self._open("r") as f:
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["k"] == "req":
+                        self.requests.append(entry)
+                    else:
+                        self._entries.setdefault(f"{entry['k']}:{entry['id']}", []).append(entry)
+            except (EOFError, ValueError):
+                # A recording cut off mid-write still replays up to the last full line
+                pass
+
+    def _write(self, entry: Dict):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = self._open("a")
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record_request(self, method: str, path: str, query: str, body: Any):
+        """Store one inbound request with its offset from the start of the recording."""
+        self._write({"k": "req", "t": round(time.time() - self._started, 4), "m": method, "p": path, "q": query, "b": body})
+
+    def _next(self, kind: str, key: str) -> Dict:
+        recordings = self._entries.get(f"{kind}:{key}")
+        if not recordings:
+            CASSETTE_EVENTS.inc(kind=kind, result="miss")
+            raise CassetteMiss(f"No {kind} recording for request {key}")
+        with self._lock:
+            position = self._positions.get(f"{kind}:{key}", 0)
+            self._positions[f"{kind}:{key}"] = position + 1
+        CASSETTE_EVENTS.inc(kind=kind, result="hit")
+        return recordings[position % len(recordings)]
+
+    def _delay(self, entry: Dict) -> float:
+        return entry["ms"] / 1000 / self.speedup if self.speedup > 0 else 0.0
+
+    async def acall(self, kind: str, request: Any, fn: Callable[[], Awaitable[Any]],
+                    encode: Callable[[Any], Any] = lambda value: value,
+                    decode: Callable[[Any], Any] = lambda value: value) -> Any:
+        """
+        Make an upstream call through the cassette.
+
+        Args:
+            kind (str): Upstream name, e.g. "llm" or "serper".
+            request (Any): JSON-serializable description of the request, hashed into its key.
+            fn (Callable): Performs the real call; only used when recording.
+            encode (Callable): Converts the result to JSON for the cassette.
+            decode (Callable): Rebuilds the result from its recording.
+
+        Raises:
+            CassetteMiss: In replay mode, if the request was never recorded.
+        """
+        key = request_key(request)
+        if self.mode == "replay":
+            entry = self._next(kind, key)
+            await asyncio.sleep(self._delay(entry))
+            return decode(entry["r"])
+        started = time.perf_counter()
+        result = await fn()
+        self._write({"k": kind, "id": key, "ms": round((time.perf_counter() - started) * 1000, 1), "r": encode(result)})
+        CASSETTE_EVENTS.inc(kind=kind, result="recorded")
+        return result
+
+    def call(self, kind: str, request: Any, fn: Callable[[], Any],
+             encode: Callable[[Any], Any] = lambda value: value,
+             decode: Callable[[Any], Any] = lambda value: value) -> Any:
+        """Blocking counterpart of acall."""
+        key = request_key(request)
+        if self.mode == "replay":
+            entry = self._next(kind, key)
+            time.sleep(self._delay(entry))
+            return decode(entry["r"])
+        started = time.perf_counter()
+        result = fn()
+        self._write({"k": kind, "id": key, "ms": round((time.perf_counter() - started) * 1000, 1), "r": encode(result)})
+        CASSETTE_EVENTS.inc(kind=kind, result="recorded")
+        return result
+
+    def record(self, kind: str, request: Any, response: Any, latency_ms: float):
+        """Store a recording made outside acall/call, e.g. a stream assembled by the caller."""
+        self._write({"k": kind, "id": request_key(request), "ms": round(latency_ms, 1), "r": response})
+        CASSETTE_EVENTS.inc(kind=kind, result="recorded")
+
+    def replay(self, kind: str, request: Any) -> Dict:
+        """The next recording of a request, with its scaled delay under "delay" (seconds)."""
+        entry = self._next(kind, request_key(request))
+        return {"response": entry["r"], "delay": self._delay(entry)}
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """
+    Return the process-wide Cassette, or None when CASSETTE_MODE is "off" (the default).
+
+    CASSETTE_MODE is "record" or "replay", CASSETTE_PATH the file, and
+    CASSETTE_SPEEDUP divides the recorded upstream latencies on replay
+    (0 answers without waiting).
+    """
+    global _cassette
+    mode = os.getenv("CASSETTE_MODE", "off").lower()
+    if mode == "off":
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(
+                    os.getenv("CASSETTE_PATH", CASSETTE_FILE),
+                    mode,
+                    speedup=float(os.getenv("CASSETTE_SPEEDUP", 1)),
+                )
+    return _cassette
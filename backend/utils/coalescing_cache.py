@@ -0,0 +1,100 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from utils.shared_kv import KVStore
+
+
+class CoalescingCache:
+    """
+    TTL cache in front of an async loader that shares one in-flight load per key.
+
+    Results the caller marks cacheable are kept for ttl seconds, evicting
+    expired entries (or the oldest one) once max_entries is reached.
+    Concurrent misses for the same key wait on a single load instead of each
+    calling upstream. With a `shared` store, results are also written there
+    and checked before loading, so workers share one cache.
+
+    The load runs in its own task and every caller waits on it through
+    asyncio.shield, so cancelling one caller (a client disconnect, a stopped
+    scheduler) neither cancels the load nor fails the other callers.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, shared: Optional[KVStore] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key: Hashable, shared_key: str, load: Callable[[], Awaitable[Any]],
+                  cacheable: Callable[[Any], bool] = lambda result: result is not None,
+                  decode: Callable[[Any], Any] = lambda value: value) -> Any:
+        """
+        Return the value for key from the cache, an identical in-flight load, the shared store, or load().
+
+        Args:
+            key (Hashable): Local cache key.
+            shared_key (str): Key of the value in the shared store.
+            load (Callable): Produces the value on a miss.
+            cacheable (Callable): Whether a loaded value may be cached; failures usually may not.
+            decode (Callable): Rebuilds a value read back from the shared store.
+        """
+        now = time.monotonic()
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] > now:
+            self.hits += 1
+            return cached[1]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, shared_key, load, cacheable, decode, now))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        return await asyncio.shield(task)
+
+    async def _load(self, key, shared_key, load, cacheable, decode, now):
+        loop = asyncio.get_running_loop()
+        if self.shared is not None:
+            value = await loop.run_in_executor(None, self.shared.get, shared_key)
+            if value is not None:
+                self.shared_hits += 1
+                result = decode(value)
+                self._store(key, result, now)
+                return result
+        self.misses += 1
+        result = await load()
+        if cacheable(result):
+            self._store(key, result, now)
+            if self.shared is not None:
+                await loop.run_in_executor(None, self.shared.set, shared_key, result, self.ttl)
+        return result
+
+    def _loaded(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Retrieve the exception in case every caller stopped waiting
+        if not task.cancelled():
+            task.exception()
+
+    def _store(self, key, result, now):
+        if len(self._entries) >= self.max_entries:
+            expired = [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for k in expired or [next(iter(self._entries))]:
+                del self._entries[k]
+        self._entries[key] = (now + self.ttl, result)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
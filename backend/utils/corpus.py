@@ -0,0 +1,155 @@
+import os
+import mmap
+import asyncio
+import time
+import threading
+from typing import Optional, Tuple
+
+from utils.constants import FILE_PATH, VERSION_FILE_PATH
+from utils.metrics import log_event
+from utils.vector_index import INDEX_DIR, VectorIndex, current_version, load_index
+
+
+def _mtime(path: str) -> Optional[Tuple[float, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CorpusSnapshot:
+    """
+    One immutable version of the knowledge corpus and its derived index.
+
+    The file is memory-mapped rather than read, and only decoded the first
+    time `content` is used, so loading a snapshot stays cheap even for a
+    multi-hundred-MB crawl that is normally served through the index.
+    """
+
+    def __init__(self, path: str, version, index: Optional[VectorIndex]):
+        self.path = path
+        self.version = version
+        self.index = index
+        self._content: Optional[str] = None
+        self._lock = threading.Lock()
+        self._mapped = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def available(self) -> bool:
+        return self._mapped is not None
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            with self._lock:
+                if self._content is None:
+                    self._content = self._mapped[:].decode("utf-8") if self._mapped is not None else ""
+        return self._content
+
+
+class CorpusManager:
+    """
+    Loads the corpus lazily and hot-swaps it when a new crawl lands.
+
+    The version marker written by crawl.py (or, without one, the corpus file)
+    and the index's CURRENT version are checked at most every check_interval
+    seconds. When they change a new snapshot is built in a background thread
+    while the old one keeps being served, then swapped in with a single
+    reference assignment; requests already holding the old snapshot finish on
+    it undisturbed. That relies on every file a snapshot maps being replaced
+    rather than rewritten: crawl.py renames information.txt into place, and
+    each index version lives in its own directory.
+    """
+
+    def __init__(
+        self,
+        path: str = FILE_PATH,
+        version_path: str = VERSION_FILE_PATH,
+        index_dir: str = INDEX_DIR,
+        check_interval: float = 5.0,
+    ):
+        self.path = path
+        self.version_path = version_path
+        self.index_dir = index_dir
+        self.check_interval = check_interval
+        self._snapshot: Optional[CorpusSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._reloading: Optional[threading.Thread] = None
+
+    def _version(self):
+        return (
+            _mtime(self.version_path) or _mtime(self.path),
+            current_version(self.index_dir),
+        )
+
+    def current(self) -> CorpusSnapshot:
+        """
+        Return the latest loaded snapshot.
+
+        Only the first call loads inline; after that a changed corpus is
+        loaded in the background and this keeps returning the previous
+        snapshot until the new one is ready.
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            self._checked_at = now
+            version = self._version()
+            if self._snapshot is None:
+                self._snapshot = self._load(version)
+            elif self._snapshot.version != version and self._reloading is None:
+                self._reloading = threading.Thread(target=self._reload, args=(version,), daemon=True)
+                self._reloading.start()
+            return self._snapshot
+
+    async def acurrent(self) -> CorpusSnapshot:
+        """current() for async code: the first load runs in the default executor instead of on the event loop."""
+        if self._snapshot is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.current)
+        return self.current()
+
+    def _reload(self, version):
+        try:
+            snapshot = self._load(version, self._snapshot)
+            with self._lock:
+                self._snapshot = snapshot
+        finally:
+            self._reloading = None
+
+    def _load(self, version, previous: Optional[CorpusSnapshot] = None) -> CorpusSnapshot:
+        try:
+            index = load_index(self.index_dir, version[1])
+        except (OSError, ValueError) as e:
+            # e.g. a version pruned between the check and the load; retry on the next check
+            log_event("corpus_load_failed", version=version, error=str(e))
+            if previous is not None:
+                return previous
+            index, version = None, (version[0], None)
+        snapshot = CorpusSnapshot(self.path, version, index)
+        if index is None:
+            # Full-text mode decodes the whole crawl on first use, so do it before the swap
+            snapshot.content
+        log_event("corpus_loaded", version=version, indexed=index is not None)
+        return snapshot
+
+    def reload(self) -> CorpusSnapshot:
+        """Force the next access to re-check the corpus on disk."""
+        self._checked_at = 0.0
+        return self.current()
+
+
+_manager: Optional[CorpusManager] = None
+
+
+def get_corpus_manager() -> CorpusManager:
+    global _manager
+    if _manager is None:
+        _manager = CorpusManager(check_interval=float(os.getenv("CORPUS_CHECK_INTERVAL", 5)))
+    return _manager
@@ -1,8 +1,14 @@
-import requests
+import httpx
 import os
 import json
+import time
+import asyncio
 from dotenv import load_dotenv
-from typing import List, Dict, Tuple, Union
+from typing import List, Dict, Optional, Tuple, Union
+from utils.metrics import span
+from utils.shared_kv import KVStore, get_shared_kv, is_shared
+from utils.cassette import CassetteMiss, get_cassette
+from utils.coalescing_cache import CoalescingCache
 
 load_dotenv()
 
@@ -32,63 +38,117 @@ def is_recent_news(date_str: str) -> bool:
     excluded_terms = ['day', 'days', "week", "weeks"]
     return all(term not in date_str for term in excluded_terms)
 
-def get_google_trend(search_type: str, query: str) -> Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]:
+SERPER_BASE_URL = os.getenv("SERPER_BASE_URL", "https://google.serper.dev")
+
+_async_client = None
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the shared async HTTP client used for Serper requests."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(os.getenv("SERPER_TIMEOUT", 15))),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _async_client
+
+def build_request(search_type: str, query: str, gl: str = "tw") -> Tuple[str, Dict[str, str], str]:
     """
-    Get the Google trend results for the given query.
+    Build the Serper request for a query.
 
     Parameters:
     search_type (str): The type of Google trend to get (search, news, shopping).
     query (str): The query to get the Google trend for.
+    gl (str): Country code of the search.
 
     Returns:
-    Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]: The Google trend results and related searches.
+    Tuple[str, Dict[str, str], str]: The URL, headers and JSON payload.
     """
     url_map = {
-        "search": "https://google.serper.dev/search",
-        "news": "https://google.serper.dev/news"
+        "search": f"{SERPER_BASE_URL}/search",
+        "news": f"{SERPER_BASE_URL}/news"
     }
 
-    search_url = url_map.get(search_type, "https://google.serper.dev/search")
+    search_url = url_map.get(search_type, f"{SERPER_BASE_URL}/search")
 
     payload = json.dumps({
         "q": query,
         "num": 10,
-        "gl": "tw"
+        "gl": gl
     })
     headers = {
         'X-API-KEY': os.getenv('SERPER_API_KEY'),
         'Content-Type': 'application/json'
     }
+    return search_url, headers, payload
+
+def parse_results(search_type: str, results: Dict) -> Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]:
+    """
+    Turn a Serper response body into formatted results.
+
+    Parameters:
+    search_type (str): The type of Google trend requested.
+    results (Dict): The decoded Serper response.
+
+    Returns:
+    Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]: The Google trend results and related searches.
+    """
+    related_searches = ["None"]
+
+    if search_type == "search":
+        related_searches = [item['query'] for item in results.get("relatedSearches", [])]
+        formatted_results = format_results(results.get('organic', []))
+        return formatted_results, related_searches
+
+    if search_type == "news":
+        news_items = results.get("news", [])
+        filtered_data = []
+        
+        for item in news_items:
+            if is_recent_news(item.get('date', '')):
+                news_data = {
+                    'title': item.get('title', 'N/A'),
+                    'link': item.get('link', 'N/A'),
+                    'snippet': item.get('snippet', 'N/A'),
+                    'date': item.get('date', 'N/A'),
+                    'source': item.get('source', 'N/A')
+                }
+                filtered_data.append(news_data)
+        
+        return filtered_data, related_searches
+
+    return {"Response": "Invalid search type provided."}, related_searches
+
+def get_google_trend(search_type: str, query: str) -> Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]:
+    """
+    Get the Google trend results for the given query.
+
+    Parameters:
+    search_type (str): The type of Google trend to get (search, news, shopping).
+    query (str): The query to get the Google trend for.
+
+    Returns:
+    Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]: The Google trend results and related searches.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return _fetch_google_trend(search_type, query)
+    try:
+        # Same key as the async path, which defaults gl to "tw" as well
+        return cassette.call("serper", [search_type, query, "tw"], lambda: _fetch_google_trend(search_type, query), decode=tuple)
+    except CassetteMiss as e:
+        return {"Response": f"Request error occurred: {e}"}, ["None"]
+
+def _fetch_google_trend(search_type: str, query: str):
+    # Only this blocking path uses requests; the server fetches through httpx
+    import requests
+
+    search_url, headers, payload = build_request(search_type, query)
 
     try:
         response = requests.post(search_url, headers=headers, data=payload)
         response.raise_for_status()  # Raise an HTTPError for bad responses (4XX, 5XX)
-        results = response.json()
-        related_searches = ["None"]
-
-        if search_type == "search":
-            related_searches = [item['query'] for item in results.get("relatedSearches", [])]
-            formatted_results = format_results(results.get('organic', []))
-            return formatted_results, related_searches
-
-        if search_type == "news":
-            news_items = results.get("news", [])
-            filtered_data = []
-            
-            for item in news_items:
-                if is_recent_news(item.get('date', '')):
-                    news_data = {
-                        'title': item.get('title', 'N/A'),
-                        'link': item.get('link', 'N/A'),
-                        'snippet': item.get('snippet', 'N/A'),
-                        'date': item.get('date', 'N/A'),
-                        'source': item.get('source', 'N/A')
-                    }
-                    filtered_data.append(news_data)
-            
-            return filtered_data, related_searches
-
-        return {"Response": "Invalid search type provided."}, related_searches
+        return parse_results(search_type, response.json())
 
     except requests.exceptions.HTTPError as http_err:
         return {"Response": f"HTTP error occurred: {http_err}"}, ["None"]
@@ -98,3 +158,125 @@ def get_google_trend(search_type: str, query: str) -> Tuple[Union[List[Dict[str,
         return {"Response": f"Key error occurred: {key_err}"}, ["None"]
     except Exception as err:
         return {"Response": f"An unexpected error occurred: {err}"}, ["None"]
+
+async def async_get_google_trend(search_type: str, query: str, gl: str = "tw") -> Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]:
+    """
+    Async variant of get_google_trend over a pooled httpx client.
+
+    Parameters:
+    search_type (str): The type of Google trend to get (search, news, shopping).
+    query (str): The query to get the Google trend for.
+    gl (str): Country code of the search.
+
+    Returns:
+    Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]: The Google trend results and related searches.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return await _async_fetch_google_trend(search_type, query, gl)
+    try:
+        return await cassette.acall(
+            "serper", [search_type, query, gl], lambda: _async_fetch_google_trend(search_type, query, gl), decode=tuple
+        )
+    except CassetteMiss as e:
+        return {"Response": f"Request error occurred: {e}"}, ["None"]
+
+async def _async_fetch_google_trend(search_type: str, query: str, gl: str):
+    search_url, headers, payload = build_request(search_type, query, gl)
+
+    try:
+        response = await get_async_http_client().post(search_url, headers=headers, content=payload)
+        response.raise_for_status()
+        return parse_results(search_type, response.json())
+
+    except httpx.HTTPStatusError as http_err:
+        return {"Response": f"HTTP error occurred: {http_err}"}, ["None"]
+    except httpx.RequestError as req_err:
+        return {"Response": f"Request error occurred: {req_err}"}, ["None"]
+    except KeyError as key_err:
+        return {"Response": f"Key error occurred: {key_err}"}, ["None"]
+    except Exception as err:
+        return {"Response": f"An unexpected error occurred: {err}"}, ["None"]
+
+
+class NewsFetcher:
+    """
+    Shared news-fetch service in front of Serper.
+
+    Successful results are cached for ttl seconds per (search_type, query, gl).
+    Concurrent requests for the same key share one in-flight upstream call
+    instead of each issuing their own. With a `shared` store, results are also
+    written there and checked before calling Serper, so workers share one cache.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 512, shared: Optional[KVStore] = None):
+        self.cache = CoalescingCache(ttl, max_entries, shared)
+
+    async def fetch(self, search_type: str, query: str, gl: str = "tw") -> Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]:
+        """
+        Get results for one query, from cache, an identical in-flight call, or Serper.
+
+        Parameters:
+        search_type (str): The type of Google trend to get (search, news).
+        query (str): The query to get the Google trend for.
+        gl (str): Country code of the search.
+
+        Returns:
+        Tuple[Union[List[Dict[str, str]], Dict[str, str]], List[str]]: The Google trend results and related searches.
+        """
+        async def search():
+            with span("upstream_search"):
+                return await async_get_google_trend(search_type, query, gl)
+
+        return await self.cache.get(
+            (search_type, query, gl),
+            f"news:{search_type}:{gl}:{query}",
+            search,
+            # Errors come back as a dict; only cache real result lists
+            cacheable=lambda result: isinstance(result[0], list),
+            decode=tuple,
+        )
+
+    async def fetch_many(self, queries: List[Tuple[str, str]], gl: str = "tw") -> List[Tuple]:
+        """Fetch several (search_type, query) pairs concurrently, in input order."""
+        return await asyncio.gather(*(self.fetch(search_type, query, gl) for search_type, query in queries))
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+def dedupe_articles(*article_lists: Union[List[Dict[str, str]], Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Merge article lists, keeping the first article seen for each link.
+
+    Parameters:
+    article_lists: Results of get_google_trend; error dicts are skipped.
+
+    Returns:
+    List[Dict[str, str]]: Unique articles in their original order.
+    """
+    seen = set()
+    articles = []
+    for article_list in article_lists:
+        if not isinstance(article_list, list):
+            continue
+        for article in article_list:
+            link = article.get("link")
+            if link in seen:
+                continue
+            seen.add(link)
+            articles.append(article)
+    return articles
+
+
+_news_fetcher = None
+
+def get_news_fetcher() -> NewsFetcher:
+    """Return the process-wide NewsFetcher; NEWS_CACHE_TTL sets its cache lifetime in seconds."""
+    global _news_fetcher
+    if _news_fetcher is None:
+        _news_fetcher = NewsFetcher(
+            ttl=float(os.getenv("NEWS_CACHE_TTL", 300)),
+            shared=get_shared_kv() if is_shared() else None,
+        )
+    return _news_fetcher
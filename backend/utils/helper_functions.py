@@ -1,20 +1,52 @@
-import tiktoken 
-import requests
 import os
+import functools
 from dotenv import load_dotenv
 load_dotenv()
 
 COMPLETIONS_MODEL = "gpt-4o-mini"
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name = COMPLETIONS_MODEL):
+    """Returns the tiktoken encoding for a model, building it only once per process."""
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(encoding_name)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
 def num_tokens_from_string(string: str, encoding_name = COMPLETIONS_MODEL) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    return len(get_encoding(encoding_name).encode(string))
+
+@functools.lru_cache(maxsize=256)
+def num_tokens_cached(string: str, encoding_name = COMPLETIONS_MODEL) -> int:
+    """Like num_tokens_from_string, memoized for static segments such as system prompts."""
+    return num_tokens_from_string(string, encoding_name)
+
+@functools.lru_cache(maxsize=None)
+def _session():
+    import requests
+
+    return requests.Session()
+
+def get_token_balances(wallet_address, chain_id=1):
+    """
+    Blocking single-wallet lookup, kept for scripts. The server uses
+    utils.portfolio.PortfolioFetcher, which fans out and caches.
+    """
+    import requests
+    from utils.portfolio import balances_url
 
-def get_token_balances(wallet_address):
-    endpoint = f'https://api.1inch.dev/balance/v1.2/1/balances/{wallet_address}'
-    response = requests.get(endpoint, headers={'Authorization': os.getenv("INCH_API_KEY")})
+    try:
+        response = _session().get(
+            balances_url(chain_id, wallet_address),
+            headers={'Authorization': os.getenv("INCH_API_KEY", "")},
+            timeout=float(os.getenv("INCH_TIMEOUT", 10)),
+        )
+    except requests.RequestException as e:
+        print(f"Failed to fetch token balances. Error: {str(e)}")
+        return None
 
     if response.status_code == 200:
         return response.json()
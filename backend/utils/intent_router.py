@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.metrics import INTENT_FAST_PATH
+
+NUMBER = r"\d+(?:[.,]\d+)?"
+TOKEN = r"[a-z][a-z0-9.]{1,9}"
+
+# (intent_type, patterns). Every pattern must match the whole normalized
+# input, so anything with extra clauses or a question falls through to the planner.
+DEFAULT_RULES: List[Tuple[str, Sequence[str]]] = [
+    ("deposit", [
+        rf"(?:deposit|stake|supply|invest|put) (?:{NUMBER}|all|max) ?(?:{TOKEN})?(?: (?:in|into|to|on) [a-z0-9 ]{{1,30}})?",
+    ]),
+    ("withdraw", [
+        rf"(?:withdraw|unstake|redeem|take out) (?:{NUMBER}|all|max|everything) ?(?:{TOKEN})?(?: (?:from|out of) [a-z0-9 ]{{1,30}})?",
+    ]),
+    ("balance", [
+        rf"(?:show|check|get|view|see) (?:me )?(?:my )?(?:{TOKEN} )?(?:balance|balances|holdings|wallet|portfolio balance)",
+        r"(?:my )?(?:balance|balances|holdings)",
+        rf"how much {TOKEN} do i have",
+    ]),
+    ("swap", [
+        rf"(?:swap|convert|exchange|trade) (?:{NUMBER} )?{TOKEN} (?:to|for|into) {TOKEN}",
+    ]),
+    ("build_portfolio", [
+        r"(?:build|create|make|start) (?:me )?(?:a |my )?(?:new )?(?:risk[- ]diversified |diversified |defi )*portfolio",
+    ]),
+]
+
+MAX_FAST_PATH_WORDS = 12
+
+
+def normalize(text: str) -> str:
+    text = text.strip().lower()
+    text = re.sub(r"[!.]+$", "", text)
+    return re.sub(r"\s+", " ", text)
+
+
+class IntentRouter:
+    """
+    Local fast path in front of the LLM planner for inputs that need no model to classify.
+
+    All rules are compiled into one alternation with a named group per intent,
+    so classifying is a single anchored regex match. Inputs that match no rule,
+    are long, or ask a question return None and go to the planner unchanged.
+    """
+
+    def __init__(self, rules: List[Tuple[str, Sequence[str]]] = DEFAULT_RULES):
+        self.group_intents: Dict[str, str] = {}
+        alternatives = []
+        for intent_index, (intent_type, patterns) in enumerate(rules):
+            for pattern_index, pattern in enumerate(patterns):
+                group = f"i{intent_index}_{pattern_index}"
+                self.group_intents[group] = intent_type
+                alternatives.append(f"(?P<{group}>{pattern})")
+        self.pattern = re.compile("|".join(alternatives))
+
+    def classify(self, text: str) -> Optional[Dict[str, str]]:
+        """
+        Return the planner-shaped {"intent_type": ...} for a confident match, or None to escalate.
+        """
+        normalized = normalize(text)
+        if not normalized or "?" in normalized or len(normalized.split()) > MAX_FAST_PATH_WORDS:
+            INTENT_FAST_PATH.inc(result="miss")
+            return None
+        match = self.pattern.fullmatch(normalized)
+        if match is None:
+            INTENT_FAST_PATH.inc(result="miss")
+            return None
+        intent_type = self.group_intents[match.lastgroup]
+        INTENT_FAST_PATH.inc(result="hit", intent_type=intent_type)
+        return {"intent_type": intent_type}
+
+
+def load_rules(path: str) -> List[Tuple[str, Sequence[str]]]:
+    """Rules from a JSON object of intent_type -> list of regexes, in priority order."""
+    with open(path, "r", encoding="utf-8") as f:
+        return list(json.load(f).items())
+
+
+_router: Optional[IntentRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_intent_router() -> Optional[IntentRouter]:
+    """
+    Return the process-wide IntentRouter, or None unless INTENT_FAST_PATH is "on".
+
+    The fast path is off by default: the intent names of DEFAULT_RULES are
+    inferred rather than taken from the planner prompt. Turn it on with an
+    INTENT_RULES_PATH rules file checked against logged planner outputs with
+    benchmarks.intent_replay.
+    """
+    global _router
+    if os.getenv("INTENT_FAST_PATH", "off").lower() != "on":
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                rules_path = os.getenv("INTENT_RULES_PATH")
+                _router = IntentRouter(load_rules(rules_path) if rules_path else DEFAULT_RULES)
+    return _router
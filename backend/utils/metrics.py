@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# USD per 1M (input, cached input, output) tokens, used for the cost counter
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+}
+
+# Route of the request being served, used to label spans and token counters
+current_endpoint: contextvars.ContextVar = contextvars.ContextVar("current_endpoint", default="background")
+
+JSON_LOGS = os.getenv("JSON_LOGS", "off").lower() == "on"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def render(self) -> str:
+        return super().render().replace(f"# TYPE {self.name} counter", f"# TYPE {self.name} gauge")
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (bucket_counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', str(bound))])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines)
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency by route")
+REQUESTS = Counter("http_requests_total", "Requests by route and status")
+STAGE_LATENCY = Histogram("stage_duration_seconds", "Latency of request stages (upstream search and balances, tokenization, llm, storage)")
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens by endpoint, model and direction (input, cached_input, output)")
+LLM_COST = Counter("llm_cost_usd_total", "Estimated LLM spend in USD by endpoint and model")
+CACHE_STATS = Gauge("cache_stats", "Counters of the response, news and portfolio caches")
+LLM_GATEWAY_STATS = Gauge("llm_gateway_stats", "In-flight and queued LLM calls, retries, rejections and queue timeouts")
+CASSETTE_EVENTS = Counter("cassette_events_total", "Upstream calls recorded to, replayed from (hit) or missing from the cassette")
+INTENT_FAST_PATH = Counter("intent_fast_path_total", "/process inputs classified by the local intent rules (hit) or sent to the planner (miss)")
+
+METRICS = [REQUEST_LATENCY, REQUESTS, STAGE_LATENCY, LLM_TOKENS, LLM_COST, CACHE_STATS, LLM_GATEWAY_STATS, INTENT_FAST_PATH, CASSETTE_EVENTS]
+
+
+def log_event(event: str, **fields):
+    """Emit one structured JSON log line when JSON_LOGS is on."""
+    if JSON_LOGS:
+        print(json.dumps({"ts": time.time(), "event": event, **fields}), flush=True)
+
+
+@contextmanager
+def span(stage: str):
+    """Time one stage of the current request into stage_duration_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        endpoint = current_endpoint.get()
+        STAGE_LATENCY.observe(elapsed, stage=stage, endpoint=endpoint)
+        log_event("span", stage=stage, endpoint=endpoint, duration_ms=round(elapsed * 1000, 3))
+
+
+def record_tokens(model: Optional[str], input_tokens: int, output_tokens: int, cached_tokens: int = 0):
+    """
+    Count tokens and estimated cost of one LLM call against the current endpoint.
+
+    cached_tokens is the part of input_tokens served from the provider's
+    prompt cache; it is counted on its own and priced at the cached rate.
+    """
+    endpoint = current_endpoint.get()
+    model = model or "unknown"
+    LLM_TOKENS.inc(input_tokens, endpoint=endpoint, model=model, direction="input")
+    LLM_TOKENS.inc(cached_tokens, endpoint=endpoint, model=model, direction="cached_input")
+    LLM_TOKENS.inc(output_tokens, endpoint=endpoint, model=model, direction="output")
+    input_price, cached_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+    cost = (input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + output_tokens * output_price
+    LLM_COST.inc(cost / 1_000_000, endpoint=endpoint, model=model)
+    log_event(
+        "llm_tokens", endpoint=endpoint, model=model,
+        input_tokens=input_tokens, cached_tokens=cached_tokens, output_tokens=output_tokens,
+    )
+
+
+def render_metrics() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
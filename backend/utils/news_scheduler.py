@@ -0,0 +1,97 @@
+import os
+import time
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from utils.shared_kv import KVStore
+
+
+class NewsSummaryScheduler:
+    """
+    Periodically precomputes /search results for the always-included feeds and the most requested queries.
+
+    `compute(query)` builds the full response for a query (fetch, dedupe,
+    summarize). The scheduler runs it in the background every `interval`
+    seconds and keeps the latest result with its timestamp, so the request
+    path can serve a precomputed summary and only compute cold queries.
+
+    With a `shared` store, results are published there for every worker and
+    each refresh round is run by whichever worker takes the round's lease,
+    so N workers do not summarize the same feeds N times.
+    """
+
+    def __init__(
+        self,
+        compute: Callable[[str], Awaitable[Dict[str, Any]]],
+        always_queries: Iterable[str] = ("crypto",),
+        interval: float = 600,
+        max_age: float = 900,
+        max_popular: int = 5,
+        shared: Optional[KVStore] = None,
+    ):
+        self.compute = compute
+        self.always_queries = list(always_queries)
+        self.interval = interval
+        self.max_age = max_age
+        self.max_popular = max_popular
+        self.shared = shared
+        self.query_counts: Counter = Counter()
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record_query(self, query: str):
+        self.query_counts[query] += 1
+        if len(self.query_counts) > 10000:
+            # Keep popularity tracking bounded under many one-off queries
+            self.query_counts = Counter(dict(self.query_counts.most_common(1000)))
+
+    async def get(self, query: str) -> Optional[Dict[str, Any]]:
+        """Return the precomputed result for query if it is younger than max_age."""
+        result = self._results.get(query)
+        if result is None and self.shared is not None:
+            # The shared store does blocking I/O, so keep it off the event loop
+            result = await asyncio.get_running_loop().run_in_executor(None, self.shared.get, f"news_summary:{query}")
+        if result is None or time.time() - result["updated_at"] > self.max_age:
+            return None
+        return result
+
+    async def store(self, query: str, result: Dict[str, Any]):
+        self._results[query] = {**result, "updated_at": time.time()}
+        if self.shared is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.shared.set, f"news_summary:{query}", self._results[query], self.max_age
+            )
+        stale = [q for q, r in self._results.items() if time.time() - r["updated_at"] > self.max_age]
+        for q in stale:
+            del self._results[q]
+
+    def scheduled_queries(self):
+        popular = [query for query, _ in self.query_counts.most_common(self.max_popular)]
+        return list(dict.fromkeys(self.always_queries + popular))
+
+    async def refresh(self, query: str):
+        try:
+            await self.store(query, await self.compute(query))
+        except Exception as e:
+            print(f"Precomputing news summary for {query} failed: {str(e)}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.shared is None or await loop.run_in_executor(None, self.shared.add, "news_summary:lease", os.getpid(), self.interval):
+                await asyncio.gather(*(self.refresh(query) for query in self.scheduled_queries()))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
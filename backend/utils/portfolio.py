@@ -0,0 +1,142 @@
+import os
+import re
+import asyncio
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from utils.coalescing_cache import CoalescingCache
+from utils.metrics import span
+from utils.shared_kv import KVStore, get_shared_kv, is_shared
+
+load_dotenv()
+
+INCH_BASE_URL = os.getenv("INCH_BASE_URL", "https://api.1inch.dev")
+
+# Wallets are interpolated into the API path, so only plain EVM addresses are accepted
+WALLET_ADDRESS = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+# Chain ids served by the 1inch balance API
+SUPPORTED_CHAINS = {1, 10, 56, 100, 137, 250, 324, 8217, 8453, 42161, 43114, 59144, 1313161554}
+
+_async_client = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the shared async HTTP client used for balance API requests."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(os.getenv("INCH_TIMEOUT", 10))),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _async_client
+
+
+def balances_url(chain_id: int, wallet_address: str) -> str:
+    if not WALLET_ADDRESS.match(wallet_address):
+        raise ValueError(f"Invalid wallet address: {wallet_address!r}")
+    return f"{INCH_BASE_URL}/balance/v1.2/{chain_id}/balances/{wallet_address}"
+
+
+async def async_get_token_balances(chain_id: int, wallet_address: str) -> Optional[Dict[str, str]]:
+    """
+    Get the token balances of one wallet on one chain.
+
+    Parameters:
+    chain_id (int): EVM chain id.
+    wallet_address (str): Wallet address.
+
+    Returns:
+    Optional[Dict[str, str]]: Token contract address -> raw balance, or None if the request failed.
+    """
+    try:
+        response = await get_async_http_client().get(
+            balances_url(chain_id, wallet_address),
+            headers={"Authorization": os.getenv("INCH_API_KEY", "")},
+        )
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Failed to fetch token balances for {wallet_address} on chain {chain_id}: {str(e)}")
+        return None
+
+
+class PortfolioFetcher:
+    """
+    Fetches token balances for many (chain, wallet) pairs at once.
+
+    Requests fan out concurrently over one pooled client, at most
+    `concurrency` at a time to stay within the provider's rate limit.
+    Successful results are cached for ttl seconds per (chain, wallet),
+    concurrent requests for the same pair share one upstream call, and with a
+    `shared` store the cache is shared between workers.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 4096, concurrency: int = 16, shared: Optional[KVStore] = None):
+        self.cache = CoalescingCache(ttl, max_entries, shared)
+        self._semaphore_size = concurrency
+        self._semaphore = None
+        self._semaphore_loop = None
+        self.failures = 0
+
+    def _limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._semaphore_size)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def fetch(self, chain_id: int, wallet_address: str) -> Optional[Dict[str, str]]:
+        """Balances of one wallet on one chain, from cache, an identical in-flight call, or the API."""
+        async def load():
+            async with self._limit():
+                with span("upstream_balances"):
+                    result = await async_get_token_balances(chain_id, wallet_address)
+            if result is None:
+                self.failures += 1
+            return result
+
+        wallet = wallet_address.lower()
+        return await self.cache.get((chain_id, wallet), f"portfolio:{chain_id}:{wallet}", load)
+
+    async def fetch_portfolio(self, wallets: Iterable[str], chains: Iterable[int]) -> Dict[str, Dict[int, Optional[Dict[str, str]]]]:
+        """
+        Balances of every wallet on every chain, fetched concurrently.
+
+        Parameters:
+        wallets (Iterable[str]): Wallet addresses.
+        chains (Iterable[int]): Chain ids.
+
+        Returns:
+        Dict[str, Dict[int, Optional[Dict[str, str]]]]: wallet -> chain id -> balances, None where the fetch failed.
+        """
+        pairs: List[Tuple[str, int]] = [(wallet, chain_id) for wallet in dict.fromkeys(wallets) for chain_id in dict.fromkeys(chains)]
+        results = await asyncio.gather(*(self.fetch(chain_id, wallet) for wallet, chain_id in pairs))
+        portfolio: Dict[str, Dict[int, Optional[Dict[str, str]]]] = {}
+        for (wallet, chain_id), balances in zip(pairs, results):
+            portfolio.setdefault(wallet, {})[chain_id] = balances
+        return portfolio
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.cache.stats(), "failures": self.failures}
+
+
+_portfolio_fetcher = None
+
+def get_portfolio_fetcher() -> PortfolioFetcher:
+    """
+    Return the process-wide PortfolioFetcher.
+
+    PORTFOLIO_CACHE_TTL sets its cache lifetime in seconds and
+    PORTFOLIO_CONCURRENCY the number of balance requests in flight at once.
+    """
+    global _portfolio_fetcher
+    if _portfolio_fetcher is None:
+        _portfolio_fetcher = PortfolioFetcher(
+            ttl=float(os.getenv("PORTFOLIO_CACHE_TTL", 30)),
+            concurrency=int(os.getenv("PORTFOLIO_CONCURRENCY", 16)),
+            shared=get_shared_kv() if is_shared() else None,
+        )
+    return _portfolio_fetcher
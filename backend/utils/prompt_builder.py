@@ -0,0 +1,87 @@
+import re
+from typing import Callable, Dict, Iterable, List, Tuple
+
+NEWS_TOKEN_BUDGET = 3000
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_AGE_UNITS = {
+    "sec": 1, "second": 1,
+    "min": 60, "minute": 60,
+    "hour": 3600, "hr": 3600,
+    "day": 86400,
+    "week": 604800,
+    "month": 2592000,
+    "year": 31536000,
+}
+_AGE_PATTERN = re.compile(r"(\d+)\s*(sec|second|min|minute|hour|hr|day|week|month|year)s?\s+ago")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) that needs no tokenizer."""
+    return len(text) // 4 + 1
+
+
+def parse_age_seconds(date_str: str) -> float:
+    """Age of a Serper relative date such as "3 hours ago"; unknown formats sort last."""
+    match = _AGE_PATTERN.search(str(date_str).lower())
+    if not match:
+        return float("inf")
+    return int(match.group(1)) * _AGE_UNITS[match.group(2)]
+
+
+def _shingles(title: str) -> frozenset:
+    words = re.findall(r"\w+", title.lower())
+    if len(words) < 3:
+        return frozenset(words)
+    return frozenset(zip(words, words[1:], words[2:]))
+
+
+def _is_near_duplicate(shingles: frozenset, kept: List[frozenset], threshold: float) -> bool:
+    for other in kept:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= threshold:
+            return True
+    return False
+
+
+def build_news_prompt(
+    items: Iterable[Dict[str, str]],
+    token_budget: int = NEWS_TOKEN_BUDGET,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    threshold: float = NEAR_DUPLICATE_THRESHOLD,
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Build the summarization input from news items within a token budget.
+
+    Items are taken newest first (by their relative `date`), headlines that
+    are near-duplicates of one already taken are skipped, and assembly stops
+    once the next item would exceed token_budget. The text is joined once at
+    the end, so building is linear in the number of items taken.
+
+    Args:
+        items: News items with title, snippet and date.
+        token_budget: Maximum tokens of the returned text.
+        count_tokens: Token counter for one item's text.
+        threshold: Jaccard similarity of title word trigrams above which two headlines are duplicates.
+
+    Returns:
+        Tuple[str, List[Dict[str, str]]]: Prompt text and the items it includes.
+    """
+    ranked = sorted(items, key=lambda item: parse_age_seconds(item.get("date", "")))
+    parts = []
+    used = []
+    kept_shingles: List[frozenset] = []
+    tokens = 0
+    for item in ranked:
+        shingles = _shingles(item.get("title", ""))
+        if _is_near_duplicate(shingles, kept_shingles, threshold):
+            continue
+        text = f"{item.get('title', '')}\n{item.get('snippet', '')}\n"
+        cost = count_tokens(text)
+        if tokens + cost > token_budget:
+            break
+        tokens += cost
+        parts.append(text)
+        used.append(item)
+        kept_shingles.append(shingles)
+    return "".join(parts), used
@@ -0,0 +1,257 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils.constants import FILE_PATH
+from utils.shared_kv import KVStore, get_shared_kv, is_shared
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def corpus_version(path: str = FILE_PATH) -> Optional[float]:
+    """Modification time of the crawl output, used to drop cached answers after a re-crawl."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ResponseCache:
+    """
+    Two-layer cache for LLM responses.
+
+    The exact layer is keyed by (model, system prompt hash, prompt hash). The
+    optional semantic layer matches a new question against the embeddings of
+    cached questions with the same model and system prompt, and returns a
+    cached answer when cosine similarity reaches similarity_threshold. The
+    embeddings are rows of one matrix, so a lookup is a single product.
+    Only use it for read-only answers: questions that differ in an amount or
+    recipient can be near-identical.
+    Entries expire after ttl seconds and the least recently used entry is
+    evicted once max_entries is reached. The whole cache is cleared when
+    version_fn returns a new value, e.g. after information.txt is re-crawled.
+
+    With a `shared` store, exact-layer entries are also written there and
+    read back on a local miss, so workers answer from each other's calls.
+    Shared keys include the version, so a re-crawl invalidates them too.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        embedder: Optional[Callable] = None,
+        similarity_threshold: float = 0.95,
+        version_fn: Optional[Callable[[], Any]] = corpus_version,
+        shared: Optional[KVStore] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.version_fn = version_fn
+        self.shared = shared
+        self._version = version_fn() if version_fn else None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Semantic-layer embeddings, one row per entry that has one; free rows are zero
+        self._vectors: Optional[np.ndarray] = None
+        self._row_keys: List[Optional[str]] = [None] * max_entries
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.embedder is not None
+
+    @property
+    def blocking(self) -> bool:
+        """True when lookups do I/O (embedding calls or a shared store) and belong off the event loop."""
+        return self.semantic or self.shared is not None
+
+    def _key(self, model: str, system_prompt: str, prompt: str) -> str:
+        return f"{model}:{_hash(system_prompt)}:{_hash(prompt)}"
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embedder([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self._clear()
+            self.invalidations += 1
+
+    def _evict_expired(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry["expires_at"] > now:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def get(self, model: str, system_prompt: str, prompt: str, semantic_text: Optional[str] = None) -> Optional[Any]:
+        """
+        Look up a cached response.
+
+        Args:
+            model (str): Model name.
+            system_prompt (str): System prompt of the call.
+            prompt (str): Full user prompt, for the exact layer.
+            semantic_text (str, optional): Short text to compare in the semantic layer, e.g. the user's question.
+
+        Returns:
+            The cached response, or None on a miss.
+        """
+        query_vector = self._embed(semantic_text) if self.semantic and semantic_text else None
+        now = time.monotonic()
+        with self._lock:
+            self._check_version()
+            key = self._key(model, system_prompt, prompt)
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["value"]
+            version = self._version
+
+        if self.shared is not None:
+            value = self.shared.get(f"llm:{version}:{key}")
+            if value is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                    self._put(key, value, model, system_prompt, None, now)
+                return value
+
+        with self._lock:
+            if query_vector is not None and self._vectors is not None:
+                namespace = (model, _hash(system_prompt))
+                scores = self._vectors @ query_vector
+                rows = np.flatnonzero(scores >= self.similarity_threshold)
+                for row in rows[np.argsort(-scores[rows])]:
+                    candidate_key = self._row_keys[row]
+                    candidate = self._entries.get(candidate_key) if candidate_key is not None else None
+                    if candidate is None or candidate["namespace"] != namespace or candidate["expires_at"] <= now:
+                        continue
+                    self._entries.move_to_end(candidate_key)
+                    self.semantic_hits += 1
+                    return candidate["value"]
+
+            self.misses += 1
+            return None
+
+    def set(self, model: str, system_prompt: str, prompt: str, value: Any, semantic_text: Optional[str] = None):
+        """Store a response; semantic_text is embedded for the semantic layer when enabled."""
+        vector = self._embed(semantic_text) if self.semantic and semantic_text else None
+        now = time.monotonic()
+        key = self._key(model, system_prompt, prompt)
+        with self._lock:
+            self._check_version()
+            self._put(key, value, model, system_prompt, vector, now)
+            version = self._version
+        if self.shared is not None:
+            self.shared.set(f"llm:{version}:{key}", value, self.ttl)
+
+    def _put(self, key: str, value: Any, model: str, system_prompt: str, vector: Optional[np.ndarray], now: float):
+        if key in self._entries:
+            self._remove(key)
+        self._evict_expired(now)
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        row = None
+        if vector is not None:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            row = self._free_rows.pop()
+            self._vectors[row] = vector
+            self._row_keys[row] = key
+        self._entries[key] = {
+            "value": value,
+            "expires_at": now + self.ttl,
+            "namespace": (model, _hash(system_prompt)),
+            "row": row,
+        }
+
+    def _remove(self, key: str):
+        row = self._entries.pop(key)["row"]
+        if row is not None:
+            self._vectors[row] = 0.0
+            self._row_keys[row] = None
+            self._free_rows.append(row)
+
+    def _clear(self):
+        self._entries.clear()
+        self._vectors = None
+        self._row_keys = [None] * self.max_entries
+        self._free_rows = list(range(self.max_entries - 1, -1, -1))
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Return the process-wide response cache, or None when RESPONSE_CACHE is "off".
+
+    RESPONSE_CACHE_SIZE and RESPONSE_CACHE_TTL bound the cache. Setting
+    SEMANTIC_CACHE_EMBEDDER ("openai" or "hashing") enables the semantic layer,
+    with SEMANTIC_CACHE_THRESHOLD as the minimum cosine similarity. When
+    SHARED_STATE selects a shared store, exact-match entries are shared
+    between workers through it.
+    """
+    global _cache
+    if os.getenv("RESPONSE_CACHE", "on").lower() == "off":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                embedder_name = os.getenv("SEMANTIC_CACHE_EMBEDDER")
+                embedder = None
+                if embedder_name:
+                    from utils.vector_index import get_embedder
+                    embedder = get_embedder(embedder_name)
+                _cache = ResponseCache(
+                    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 1024)),
+                    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+                    embedder=embedder,
+                    similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+                    shared=get_shared_kv() if is_shared() else None,
+                )
+    return _cache
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Optional
+
+SQLITE_KV_FILE = "./data/shared_state.db"
+
+
+class KVStore:
+    """
+    Minimal key-value interface for state shared between worker processes.
+
+    Values are JSON-serializable objects; ttl is in seconds.
+    """
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        """Set key only if it is absent or expired. Returns True if this call set it."""
+        raise NotImplementedError
+
+
+class MemoryKV(KVStore):
+    """Process-local store; the default for single-worker deployments."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None or entry[0] <= time.time():
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._values[key] = (time.time() + ttl, value)
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and entry[0] > time.time():
+                return False
+            self._values[key] = (time.time() + ttl, value)
+            return True
+
+
+class SQLiteKV(KVStore):
+    """Store shared by every worker on one host, on an SQLite database in WAL mode."""
+
+    def __init__(self, path: str = SQLITE_KV_FILE):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl),
+        )
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        now = time.time()
+        cursor = self._connection().execute(
+            """
+            INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+            WHERE kv.expires_at <= ?
+            """,
+            (key, json.dumps(value), now + ttl, now),
+        )
+        return cursor.rowcount > 0
+
+
+class RedisKV(KVStore):
+    """Store shared across hosts, over the Redis protocol (Redis, Valkey or any compatible stand-in)."""
+
+    def __init__(self, url: str = "redis://localhost:6379/0"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(key, json.dumps(value), px=max(int(ttl * 1000), 1))
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        return bool(self.client.set(key, json.dumps(value), px=max(int(ttl * 1000), 1), nx=True))
+
+
+_kv: Optional[KVStore] = None
+_kv_lock = threading.Lock()
+
+
+def get_shared_kv() -> KVStore:
+    """
+    Return the process-wide shared store selected by SHARED_STATE.
+
+    "memory" (default) keeps state per process, "sqlite" shares it between
+    workers on one host through SHARED_STATE_PATH, and "redis" shares it
+    across hosts through REDIS_URL.
+    """
+    global _kv
+    if _kv is None:
+        with _kv_lock:
+            if _kv is None:
+                backend = os.getenv("SHARED_STATE", "memory").lower()
+                if backend == "sqlite":
+                    _kv = SQLiteKV(os.getenv("SHARED_STATE_PATH", SQLITE_KV_FILE))
+                elif backend == "redis":
+                    _kv = RedisKV(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+                elif backend == "memory":
+                    _kv = MemoryKV()
+                else:
+                    raise ValueError(f"Unknown shared state backend: {backend}")
+    return _kv
+
+
+def is_shared() -> bool:
+    return os.getenv("SHARED_STATE", "memory").lower() != "memory"
@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.constants import COLLECTION_NAME, EMBEDDING_MODEL, FILE_PATH
+
+INDEX_DIR = os.path.join("./data/index", COLLECTION_NAME)
+# Names the version directory in use; replaced atomically by save()
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = 2
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 128
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into chunks of roughly chunk_size characters.
+
+    Paragraphs are packed together until the next one would overflow the chunk;
+    paragraphs longer than a chunk are cut with a sliding window. Consecutive
+    chunks share up to overlap characters so answers spanning a boundary are
+    still retrievable.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    pieces = []
+    for paragraph in paragraphs:
+        if len(paragraph) <= chunk_size:
+            pieces.append(paragraph)
+            continue
+        step = max(chunk_size - overlap, 1)
+        pieces.extend(paragraph[i:i + chunk_size] for i in range(0, len(paragraph), step))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > chunk_size:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder based on feature hashing of word unigrams and bigrams.
+
+    No network access and stable across runs, which makes it the embedder for
+    tests, benchmarks and offline development.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                bucket, sign = self._bucket(token)
+                vectors[row, bucket] += sign
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embedder backed by the OpenAI embeddings API, using the shared pooled client."""
+
+    name = "openai"
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        from models.model import get_openai_client
+        from utils.cassette import get_cassette
+
+        cassette = get_cassette()
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = texts[start:start + EMBED_BATCH_SIZE]
+
+            def embed(batch=batch):
+                response = get_openai_client().embeddings.create(model=self.model, input=batch)
+                return [item.embedding for item in response.data]
+
+            # Retrieval and the semantic cache embed on the request path, so record and replay them like completions
+            if cassette is None:
+                vectors.extend(embed())
+            else:
+                vectors.extend(cassette.call("embeddings", {"model": self.model, "input": batch}, embed))
+        return np.asarray(vectors, dtype=np.float32)
+
+
+EMBEDDERS: Dict[str, Callable[[], Callable[[List[str]], np.ndarray]]] = {
+    "hashing": HashingEmbedder,
+    "openai": OpenAIEmbedder,
+}
+
+
+def get_embedder(name: Optional[str] = None):
+    """Return an embedder by name, defaulting to the EMBEDDER env var, then "openai"."""
+    name = name or os.getenv("EMBEDDER", "openai")
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder: {name}")
+    return EMBEDDERS[name]()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """
+    In-memory cosine-similarity index over text chunks.
+
+    Vectors are L2-normalized once at build time, so a query is a single
+    matrix-vector product followed by a partial sort for the top k.
+    """
+
+    def __init__(self, chunks: List[str], vectors: np.ndarray, embedder):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.embedder = embedder
+
+    @classmethod
+    def build(cls, text: str, embedder, previous: Optional["VectorIndex"] = None) -> "VectorIndex":
+        return cls.from_chunks(chunk_text(text), embedder, previous)
+
+    @classmethod
+    def from_chunks(cls, chunks: List[str], embedder, previous: Optional["VectorIndex"] = None) -> "VectorIndex":
+        """
+        Index already split chunks, embedding only the ones previous does not have.
+
+        Chunks whose text is in a previous index built with the same embedder
+        reuse its vectors, so rebuilding after a crawl embeds only what changed.
+        """
+        known = {}
+        if previous is not None and previous.embedder.name == embedder.name:
+            known = {chunk: row for row, chunk in enumerate(previous.chunks)}
+        missing = [chunk for chunk in dict.fromkeys(chunks) if chunk not in known]
+        fresh = dict(zip(missing, _normalize(embedder(missing)))) if missing else {}
+        rows = [fresh[chunk] if chunk in fresh else previous.vectors[known[chunk]] for chunk in chunks]
+        vectors = np.vstack(rows) if rows else np.zeros((0, 1), dtype=np.float32)
+        return cls(chunks, vectors.astype(np.float32), embedder)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, str]]:
+        """
+        Return the k chunks most similar to query.
+
+        Returns:
+            List[Tuple[float, str]]: (cosine score, chunk) pairs, best first.
+        """
+        if not self.chunks:
+            return []
+        query_vector = _normalize(self.embedder([query]))[0]
+        scores = self.vectors @ query_vector
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunks[i]) for i in top]
+
+    def save(self, index_dir: str = INDEX_DIR) -> str:
+        """
+        Write the index as a new version under index_dir and make it current.
+
+        Each version gets its own directory, and CURRENT is switched to it
+        with an atomic rename once both files are complete. Files a running
+        server has memory-mapped are never rewritten, and a reader never sees
+        the vectors of one version with the chunks of another. Only the
+        newest KEEP_VERSIONS versions are kept.
+
+        Returns:
+            str: Name of the version directory.
+        """
+        version = str(time.time_ns())
+        version_dir = os.path.join(index_dir, version)
+        os.makedirs(version_dir)
+        np.save(os.path.join(version_dir, "vectors.npy"), self.vectors)
+        with open(os.path.join(version_dir, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "chunks": self.chunks}, f)
+        current_path = os.path.join(index_dir, CURRENT_FILE)
+        with open(f"{current_path}.tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(f"{current_path}.tmp", current_path)
+
+        # Unlinking keeps older versions readable by snapshots that already mapped them
+        versions = sorted((name for name in os.listdir(index_dir) if name.isdigit()), key=int)
+        for old_version in versions[:-KEEP_VERSIONS]:
+            shutil.rmtree(os.path.join(index_dir, old_version), ignore_errors=True)
+        return version
+
+    @classmethod
+    def load(cls, index_dir: str) -> "VectorIndex":
+        """Load one version directory written by save()."""
+        with open(os.path.join(index_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        return cls(meta["chunks"], vectors, get_embedder(meta["embedder"]))
+
+
+def current_version(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """Name of the current index version, or None if no index has been built."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        # Indexes saved before versioning sit directly in index_dir
+        return "." if os.path.exists(os.path.join(index_dir, "chunks.json")) else None
+
+
+def load_index(index_dir: str = INDEX_DIR, version: Optional[str] = None) -> Optional[VectorIndex]:
+    """Load a version of the persisted index, the current one by default, or None if none was built."""
+    version = version or current_version(index_dir)
+    if version is None:
+        return None
+    return VectorIndex.load(os.path.join(index_dir, version))
+
+
+def format_context(results: List[Tuple[float, str]]) -> str:
+    """Join retrieved chunks into the INFORMATION block of a prompt."""
+    return "\n\n---\n\n".join(chunk for _, chunk in results)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the retrieval index from the crawl output")
+    parser.add_argument("--source", default=FILE_PATH)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--embedder", default=None, help="openai or hashing (defaults to EMBEDDER env var)")
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding="utf-8") as f:
+        corpus = f.read()
+    index = VectorIndex.build(corpus, get_embedder(args.embedder), previous=load_index(args.index_dir))
+    index.save(args.index_dir)
+    print(f"Indexed {len(index.chunks)} chunks from {args.source} into {args.index_dir}")